@@ -0,0 +1,484 @@
+import argparse
+import ctypes
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from crime_data_backends import (DuckDBBackend, FilteredBackend, IndexedBackend, PandasBackend, count_crimes,
+                                 open_crime_counts_cube)
+from crimes_preprocessed import (CALENDAR_FEATURES, CUBE_ROLLUPS, DATE_FORMAT, HOTSPOT_COUNTS_PATH, HOTSPOT_DIMENSIONS,
+                                  HOTSPOTS_PATH, OUTPUT_PATH, RAW_DATA_PATH, build_block_mappings, calendar_feature,
+                                  get_data_preprocess, get_data_preprocess_parallel, get_data_update, impute_from_block, rollup_path)
+
+# Grouping keys and filters the dashboard charts count by, per source
+CHART_COUNTS = {
+    'crime counts': [('Primary Type', None), (['Primary Type', 'Arrest'], None), (['Primary Type', 'Domestic'], None),
+                     ('Community Area', None), ('Ward', None), (['District', 'Primary Type'], None),
+                     (['District', 'Beat'], None), (['Community Area', 'Primary Type'], None),
+                     (['Ward', 'Primary Type'], None), ('District', None), (['District', 'Arrest'], None),
+                     ('Beat', None), (['Beat', 'Arrest'], None), ('Year', None), ('month', None),
+                     ('weekday', None), ('hour', None), (['weekday', 'hour'], None),
+                     ('Primary Type', {'District': [1, 2, 3]})],
+    'crimes': [(['Community Area', 'Block'], None), (['Ward', 'Block'], None),
+               ('Block', {'Ward': [1, 2], 'Community Area': [3]})],
+}
+
+PRIMARY_TYPES = ['THEFT', 'BATTERY', 'CRIMINAL DAMAGE', 'NARCOTICS', 'ASSAULT', 'OTHER OFFENSE',
+                 'BURGLARY', 'MOTOR VEHICLE THEFT', 'DECEPTIVE PRACTICE', 'ROBBERY']
+# Chicago has 25 police districts of about a dozen beats each, numbered
+# district, sector, beat: beat 0111 is in sector 1 of district 1
+BEATS = np.array([district * 100 + sector * 10 + beat for district in range(1, 26)
+                  for sector in range(1, 5) for beat in range(1, 4)])
+LOCATION_DESCRIPTIONS = ['STREET', 'RESIDENCE', 'APARTMENT', 'SIDEWALK', 'OTHER', 'PARKING LOT/GARAGE(NON.RESID.)']
+
+
+def make_synthetic_crimes(n_rows, n_blocks=60000, null_rate=0.05, seed=0):
+    # Mimics the raw dataset after the unused columns are dropped, with the real
+    # cardinalities: 77 community areas, 50 wards, 25 districts, 300 beats
+    # and n_blocks blocks. Like in the city, neighbouring blocks share their
+    # beat, ward and community area, so every block lies in one of each and
+    # the areas overlap only at their edges.
+    rng = np.random.default_rng(seed)
+    block_ids = rng.integers(0, n_blocks, n_rows)
+    beats = BEATS[block_ids * len(BEATS) // n_blocks]
+    blocks = np.array([f"{block_id % 100:03d}XX W STREET {block_id}" for block_id in range(n_blocks)], dtype=object)
+    dates = pd.Timestamp('2001-01-01') + pd.to_timedelta(rng.integers(0, 22 * 365 * 24 * 3600, n_rows), unit='s')
+
+    def with_nulls(values):
+        values = values.astype('float64')
+        values[rng.random(n_rows) < null_rate] = np.nan
+        return values
+
+    chicago_crimes_df = pd.DataFrame({
+        'ID': np.arange(1, n_rows + 1),
+        'Date': dates.strftime('%m/%d/%Y %I:%M:%S %p'),
+        'Block': blocks[block_ids],
+        'Primary Type': rng.choice(PRIMARY_TYPES, n_rows),
+        'Location Description': rng.choice(LOCATION_DESCRIPTIONS, n_rows),
+        'Arrest': rng.random(n_rows) < 0.25,
+        'Domestic': rng.random(n_rows) < 0.15,
+        'Beat': beats,
+        'District': with_nulls(beats // 100),
+        'Ward': with_nulls(block_ids * 50 // n_blocks + 1),
+        'Community Area': with_nulls(block_ids * 77 // n_blocks + 1),
+        'Year': dates.year,
+        'Latitude': with_nulls(41.64 + rng.random(n_rows) * 0.38),
+        'Longitude': with_nulls(-87.94 + rng.random(n_rows) * 0.42),
+    })
+    chicago_crimes_df.loc[rng.random(n_rows) < 0.001, 'Block'] = np.nan
+    return chicago_crimes_df
+
+
+def make_synthetic_raw_crimes(n_rows, n_blocks=60000, seed=0):
+    # Adds the columns of the raw export the preprocessing drops or only keeps as metadata
+    chicago_crimes_df = make_synthetic_crimes(n_rows, n_blocks=n_blocks, seed=seed)
+    chicago_crimes_df['Case Number'] = 'JA' + chicago_crimes_df['ID'].astype(str)
+    chicago_crimes_df['IUCR'] = '0820'
+    chicago_crimes_df['Description'] = '$500 AND UNDER'
+    chicago_crimes_df['FBI Code'] = '06'
+    chicago_crimes_df['X Coordinate'] = np.nan
+    chicago_crimes_df['Y Coordinate'] = np.nan
+    chicago_crimes_df['Updated On'] = chicago_crimes_df['Date']
+    chicago_crimes_df['Location'] = np.nan
+    return chicago_crimes_df
+
+
+def impute_from_block_rowwise(chicago_crimes_df, block_mappings):
+    # The DataFrame.apply imputation the preprocessing used before, kept as the reference
+    for column, mapping in block_mappings.items():
+        mapping = mapping.to_dict()
+        chicago_crimes_df[column] = chicago_crimes_df.apply(lambda row: mapping.get(row['Block']) if pd.isna(row[column]) else row[column], axis=1)
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def dashboard_pages(app):
+    return {'Basics': app.basics, 'Crimes by Departments': app.crimes_by_police_deparements,
+            'Crimes by Areas': app.crimes_by_chicago_areas, 'Crimes by Time': app.crimes_by_time,
+            'Crime Hotspots': app.crimes_hotspots}
+
+
+def benchmark_imputation(n_rows):
+    chicago_crimes_df = make_synthetic_crimes(n_rows)
+    block_mappings = build_block_mappings(chicago_crimes_df)
+
+    rowwise_df = chicago_crimes_df.copy()
+    vectorized_df = chicago_crimes_df.copy()
+    rowwise_seconds = time_call(impute_from_block_rowwise, rowwise_df, block_mappings)
+    vectorized_seconds = time_call(impute_from_block, vectorized_df, block_mappings)
+    print(f"imputation on {n_rows:,} rows: row-wise {rowwise_seconds:.2f}s, "
+          f"vectorized {vectorized_seconds:.3f}s ({rowwise_seconds / vectorized_seconds:.0f}x)")
+
+
+@contextmanager
+def synthetic_store(n_rows, n_blocks=60000, preprocess=True):
+    # Runs the block in a temporary directory holding a synthetic raw export,
+    # preprocessed unless the block times that itself, and yields the export
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.chdir(data_dir)
+        try:
+            raw_crimes_df = make_synthetic_raw_crimes(n_rows, n_blocks=n_blocks)
+            raw_crimes_df.to_csv(RAW_DATA_PATH, index=False)
+            if preprocess:
+                get_data_preprocess()
+            yield raw_crimes_df
+        finally:
+            os.chdir(working_dir)
+
+
+def import_app():
+    # Streamlit runs without a server here, so its caches are off and every
+    # page, chart or loader is computed from scratch like on a cold start
+    import streamlit.logger
+    streamlit.logger.set_log_level('error')
+    import crime_analysis_app as app
+    return app
+
+
+def time_page(page, repeats):
+    # Median time until the page's first chart is handed to Streamlit and until the page is done
+    import matplotlib.pyplot as plt
+    import streamlit as st
+
+    chart_functions = {'plotly_chart': st.plotly_chart, 'pyplot': st.pyplot}
+    first_chart_times = []
+    page_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        first_chart = []
+
+        def recorded(chart_function):
+            def record_first_chart(*args, **kwargs):
+                if not first_chart:
+                    first_chart.append(time.perf_counter() - start)
+                return chart_function(*args, **kwargs)
+            return record_first_chart
+
+        for name, chart_function in chart_functions.items():
+            setattr(st, name, recorded(chart_function))
+        try:
+            page()
+        finally:
+            for name, chart_function in chart_functions.items():
+                setattr(st, name, chart_function)
+        page_times.append(time.perf_counter() - start)
+        first_chart_times.append(first_chart[0] if first_chart else page_times[-1])
+        plt.close('all')
+    return statistics.median(first_chart_times), statistics.median(page_times)
+
+
+def benchmark_pages(n_rows, repeats=5):
+    with synthetic_store(n_rows):
+        app = import_app()
+        for page_name, page in dashboard_pages(app).items():
+            app.LAZY_SECTIONS = False
+            eager_first_chart, eager_page = time_page(page, repeats)
+            app.LAZY_SECTIONS = True
+            lazy_first_chart, lazy_page = time_page(page, repeats)
+            print(f"{page_name}: first chart {eager_first_chart:.3f}s -> {lazy_first_chart:.3f}s, "
+                  f"page {eager_page:.3f}s -> {lazy_page:.3f}s (eager -> lazy)")
+
+
+class DateDerivedCalendarBackend(IndexedBackend):
+    # The filter index before the calendar features were stored: the calendar
+    # keys of every count are extracted from the dates of the selected crimes
+    def count(self, keys, filters=None, date_range=None):
+        key_columns = [keys] if isinstance(keys, str) else keys
+        selected_df = self.select(filters, date_range, [key for key in key_columns if key not in CALENDAR_FEATURES] + ['Date'])
+        calendar_keys = {key: calendar_feature(selected_df['Date'], key) for key in key_columns if key in CALENDAR_FEATURES}
+        return count_crimes(selected_df.assign(**calendar_keys), keys)
+
+
+def benchmark_calendar_features(n_rows, repeats=5):
+    # Renders the time page over the filter index with a date range set, once
+    # extracting the calendar keys from 'Date' per chart as before and once
+    # from the precomputed calendar columns
+    with synthetic_store(n_rows):
+        app = import_app()
+        crimes_df = app.compact_frame(pd.read_parquet(OUTPUT_PATH, columns=app.INDEX_COLUMNS))
+        date_range = (crimes_df['Date'].min(), crimes_df['Date'].max() + pd.Timedelta(days=1))
+        backends = {'derived from Date': DateDerivedCalendarBackend(crimes_df.drop(columns=list(CALENDAR_FEATURES), errors='ignore'),
+                                                                    'derived from Date', app.FILTER_COLUMNS),
+                    'precomputed': IndexedBackend(crimes_df, 'precomputed', app.FILTER_COLUMNS)}
+        app.LAZY_SECTIONS = False
+        page_times = {}
+        for name, backend in backends.items():
+            app.crime_counts = FilteredBackend(backend, {}, date_range)
+            page_times[name] = time_page(app.crimes_by_time, repeats)[1]
+        print(f"Crimes by Time over {n_rows:,} rows: page {page_times['derived from Date']:.3f}s -> "
+              f"{page_times['precomputed']:.3f}s (derived from Date -> precomputed)")
+
+
+def benchmark_parallel_scaling(n_rows, max_workers):
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+
+    with synthetic_store(n_rows, preprocess=False):
+        single_worker_seconds = None
+        for workers in worker_counts:
+            seconds = time_call(get_data_preprocess_parallel, RAW_DATA_PATH, workers)
+            single_worker_seconds = single_worker_seconds or seconds
+            speedup = single_worker_seconds / seconds
+            print(f"preprocessing {n_rows:,} rows with {workers} workers: {seconds:.2f}s, "
+                  f"speedup {speedup:.2f}x, efficiency {speedup / workers:.0%}")
+
+
+def normalized_counts(counts, keys):
+    # Backends may return keys as categoricals or strings and in another order
+    counts_df = counts.reset_index(name='Count')
+    for column in counts_df.columns:
+        if counts_df[column].dtype == object or isinstance(counts_df[column].dtype, pd.CategoricalDtype):
+            counts_df[column] = counts_df[column].astype(str)
+    counts_df['Count'] = counts_df['Count'].astype('int64')
+    return counts_df.sort_values([keys] if isinstance(keys, str) else keys).reset_index(drop=True)
+
+
+def open_backends():
+    # The cube and the individual crimes of the store in the working directory, per backend
+    return {
+        'pandas': {'crime counts': open_crime_counts_cube('pandas', None),
+                   'crimes': PandasBackend(pd.read_parquet(OUTPUT_PATH), None)},
+        'duckdb': {'crime counts': open_crime_counts_cube('duckdb', None),
+                   'crimes': DuckDBBackend(os.path.join(OUTPUT_PATH, '[0-9]*.parquet'), None)},
+    }
+
+
+def benchmark_backends(n_rows):
+    # Times every backend on the counts behind the charts, test_consistency.py
+    # checks that they agree
+    with synthetic_store(n_rows):
+        backends = open_backends()
+        for source, chart_counts in CHART_COUNTS.items():
+            for keys, filters in chart_counts:
+                timings = []
+                for name, sources in backends.items():
+                    timings.append(f"{name} {time_call(sources[source].count, keys, filters):.3f}s")
+                print(f"{source} by {keys}{f' where {filters}' if filters else ''}: {', '.join(timings)}")
+
+
+def resident_bytes():
+    # Current resident set size of the process (Linux)
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def peak_rss_bytes(function):
+    # Peak resident memory the stage adds, measured in a forked child whose
+    # high-water mark starts from the memory it inherits. Unlike tracemalloc it
+    # includes what Arrow, DuckDB and other native libraries allocate.
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+
+    def run():
+        start_bytes = resident_bytes()
+        function()
+        sender.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start_bytes)
+
+    # Free heap pages the child inherited would be reused without raising its RSS
+    ctypes.CDLL(None).malloc_trim(0)
+    child = multiprocessing.get_context('fork').Process(target=run)
+    child.start()
+    child.join()
+    if child.exitcode != 0 or not receiver.poll():
+        raise RuntimeError(f"the stage failed in the child measuring its memory (exit code {child.exitcode})")
+    return max(receiver.recv(), 0)
+
+
+def profile_stage(function, repeats):
+    # Median wall time over the repeats, then one more run under tracemalloc for
+    # the peak of the memory allocated by Python and numpy while the stage runs,
+    # and one in a child process for the peak resident memory of every library.
+    # Tracing slows the stage down, so it is kept out of the timed runs.
+    seconds = [time_call(function) for _ in range(repeats)]
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': statistics.median(seconds), 'peak_memory_mb': peak_bytes / 2**20,
+            'peak_rss_mb': peak_rss_bytes(function) / 2**20}
+
+
+def page_sections(app, page):
+    # The (title, render) sections of a page, collected instead of rendered
+    sections = []
+    render_sections = app.render_sections
+    app.render_sections = sections.extend
+    try:
+        page()
+    finally:
+        app.render_sections = render_sections
+    return sections
+
+
+def run_suite(n_rows, n_blocks, repeats):
+    # Profiles every stage from a cold start
+    import matplotlib.pyplot as plt
+
+    stages = {}
+    with synthetic_store(n_rows, n_blocks=n_blocks, preprocess=False):
+        stages['get_data_preprocess'] = profile_stage(lambda: get_data_preprocess(RAW_DATA_PATH), repeats)
+        app = import_app()
+        for loader in (app.get_data, app.get_crime_counts, app.get_crime_index):
+            stages[loader.__name__] = profile_stage(lambda: loader(app.data_version), repeats)
+        app.LAZY_SECTIONS = False
+        for page_name, page in dashboard_pages(app).items():
+            for title, render in page_sections(app, page):
+                stages[f"{page_name} / {title}"] = profile_stage(render, repeats)
+                plt.close('all')
+            stages[page_name] = profile_stage(page, repeats)
+            plt.close('all')
+
+    return {
+        'rows': n_rows,
+        'blocks': n_blocks,
+        'repeats': repeats,
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'machine': platform.machine(),
+                        'cpus': os.cpu_count(), 'data_backend': os.environ.get('CRIMES_DATA_BACKEND', 'pandas')},
+        'stages': stages,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance, min_seconds=0.01):
+    # A stage regresses when it is slower than the baseline by more than the
+    # tolerance, and by more than min_seconds so timer noise on the fast
+    # charts does not count
+    if (baseline['rows'], baseline['blocks']) != (results['rows'], results['blocks']):
+        raise ValueError(f"the baseline was recorded on {baseline['rows']:,} rows and {baseline['blocks']:,} blocks, "
+                         f"rerun with --rows {baseline['rows']} --blocks {baseline['blocks']}")
+    regressions = []
+    for stage, result in results['stages'].items():
+        if stage not in baseline['stages']:
+            print(f"{stage}: {result['seconds']:.3f}s, peak RSS {result['peak_rss_mb']:.1f} MB, not in the baseline")
+            continue
+        baseline_seconds = baseline['stages'][stage]['seconds']
+        change = result['seconds'] / baseline_seconds - 1 if baseline_seconds else 0.0
+        regressed = change > tolerance and result['seconds'] - baseline_seconds > min_seconds
+        if regressed:
+            regressions.append(stage)
+        baseline_rss = baseline['stages'][stage].get('peak_rss_mb')
+        print(f"{stage}: {baseline_seconds:.3f}s -> {result['seconds']:.3f}s ({change:+.0%}), "
+              f"peak memory {baseline['stages'][stage]['peak_memory_mb']:.1f} -> {result['peak_memory_mb']:.1f} MB, "
+              f"peak RSS {'-' if baseline_rss is None else f'{baseline_rss:.1f}'} -> {result['peak_rss_mb']:.1f} MB"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def benchmark_suite(n_rows, n_blocks, repeats, output_path, baseline_path, tolerance, save_baseline):
+    results = run_suite(n_rows, n_blocks, repeats)
+    with open(output_path, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"results of {len(results['stages'])} stages written to {output_path}")
+
+    if save_baseline:
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"baseline saved to {baseline_path}")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), tolerance)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} stages regressed by more than {tolerance:.0%}: {', '.join(regressions)}")
+    else:
+        print(f"no baseline at {baseline_path}, save one with --save-baseline")
+
+
+def sorted_frame(chicago_crimes_df, columns):
+    chicago_crimes_df = chicago_crimes_df.copy()
+    for column in chicago_crimes_df.columns:
+        if chicago_crimes_df[column].dtype == object or isinstance(chicago_crimes_df[column].dtype, pd.CategoricalDtype):
+            chicago_crimes_df[column] = chicago_crimes_df[column].astype(str)
+    return chicago_crimes_df.sort_values(columns).reset_index(drop=True)
+
+
+def preprocessed_outputs():
+    # The store, the rollups of the cube and the hotspot index in a comparable order
+    outputs = {name: sorted_frame(pd.read_parquet(rollup_path(name)), dimensions) for name, dimensions in CUBE_ROLLUPS.items()}
+    outputs['hotspots'] = sorted_frame(pd.read_parquet(HOTSPOTS_PATH), HOTSPOT_DIMENSIONS)
+    outputs['hotspot counts'] = sorted_frame(pd.read_parquet(HOTSPOT_COUNTS_PATH), HOTSPOT_DIMENSIONS)
+    outputs['store'] = sorted_frame(pd.read_parquet(OUTPUT_PATH), ['ID'])
+    return outputs
+
+
+def prepare_update(raw_crimes_df, update_share=0.25, n_corrected=1000):
+    # Preprocesses the older records of a synthetic export, then writes the
+    # whole export with the newest records and a few corrected older ones
+    # updated since. Blocks first reported with a ward or community area in the
+    # newest records exercise the imputation of rows stored with the sentinel.
+    # Returns the number of stored and of updated records.
+    n_rows = len(raw_crimes_df)
+    n_older = int(n_rows * (1 - update_share))
+    raw_crimes_df.iloc[:n_older].to_csv(RAW_DATA_PATH, index=False)
+    get_data_preprocess()
+
+    update_time = pd.Timestamp.now().strftime(DATE_FORMAT)
+    raw_crimes_df.loc[:n_corrected - 1, 'Primary Type'] = 'ARSON'
+    raw_crimes_df.loc[:n_corrected - 1, 'Updated On'] = update_time
+    raw_crimes_df.loc[n_older:, 'Updated On'] = update_time
+    raw_crimes_df.to_csv(RAW_DATA_PATH, index=False)
+    return n_older, n_rows - n_older + n_corrected
+
+
+def benchmark_update(n_rows):
+    # Times the daily update against a rebuild of the same export,
+    # test_consistency.py checks that both give the same store
+    with synthetic_store(n_rows, preprocess=False) as raw_crimes_df:
+        n_stored, n_updated = prepare_update(raw_crimes_df)
+        update_seconds = time_call(get_data_update)
+        rebuild_seconds = time_call(get_data_preprocess)
+        print(f"update of {n_updated:,} records into {n_stored:,}: update {update_seconds:.2f}s, "
+              f"rebuild {rebuild_seconds:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Chicago crimes preprocessing and dashboard.")
+    parser.add_argument('--rows', type=int, default=2000000, help="rows in the synthetic dataset")
+    parser.add_argument('--pages', action='store_true', help="benchmark the dashboard pages instead of the imputation")
+    parser.add_argument('--scaling', action='store_true', help="benchmark the parallel preprocessing with 1, 2, 4... workers")
+    parser.add_argument('--calendar', action='store_true', help="benchmark the time page with and without the precomputed calendar columns")
+    parser.add_argument('--backends', action='store_true', help="time the data backends on the counts behind the charts")
+    parser.add_argument('--update', action='store_true', help="time the daily update against a rebuild")
+    parser.add_argument('--suite', action='store_true', help="time and memory-profile every stage, page and chart, and compare to the baseline")
+    parser.add_argument('--blocks', type=int, default=60000, help="blocks in the synthetic dataset of --suite")
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs of every stage by --suite, the median is kept")
+    parser.add_argument('--output', default='benchmark_results.json', help="where --suite writes its results")
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help="results --suite compares against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="slowdown over the baseline --suite reports as a regression")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results of --suite as the new baseline")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help="most workers tried by --scaling")
+    args = parser.parse_args()
+
+    if args.suite:
+        benchmark_suite(args.rows, args.blocks, args.repeats, args.output, args.baseline, args.tolerance, args.save_baseline)
+    elif args.pages:
+        benchmark_pages(args.rows)
+    elif args.calendar:
+        benchmark_calendar_features(args.rows)
+    elif args.backends:
+        benchmark_backends(args.rows)
+    elif args.update:
+        benchmark_update(args.rows)
+    elif args.scaling:
+        benchmark_parallel_scaling(args.rows, args.max_workers)
+    else:
+        benchmark_imputation(args.rows)
+
+
+if __name__ == "__main__":
+    main()
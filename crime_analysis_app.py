@@ -1,15 +1,292 @@
+import functools
+import io
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import matplotlib.pyplot as plt
 
-@st.cache_data(persist=True)
-def get_data():
-    chicago_crimes_df = pd.read_csv("preprocessed_crimes.csv")
-    chicago_crimes_df['Date'] = pd.to_datetime(chicago_crimes_df['Date'], format='%m/%d/%Y %I:%M:%S %p')
-    return chicago_crimes_df
-
-chicago_crimes_df = get_data()
+from crime_data_backends import DuckDBBackend, FilteredBackend, IndexedBackend, PandasBackend, RollupBackend, open_crime_counts_cube
+from crimes_preprocessed import (HOTSPOT_MIN_COUNT, HOTSPOTS_PATH, OUTPUT_PATH, STATE_PATH, geohash_centers,
+                                  load_state)
+from instrumentation import ENABLED as INSTRUMENTATION
+from instrumentation import export_metrics, instrumented, record, run_records, start_run
+
+# Charts are served from the crime counts cube, individual crimes are only
+# read for the block-wise charts since blocks are not a cube dimension
+APP_COLUMNS = ['Block', 'Ward', 'Community Area']
+
+# Global filters of the sidebar. Once one is set, the pages count the crimes
+# selected through the filter index, which holds these columns sorted by date.
+FILTER_COLUMNS = ['Primary Type', 'District', 'Arrest', 'Domestic']
+INDEX_COLUMNS = ['Date', 'Primary Type', 'District', 'Arrest', 'Domestic', 'Beat', 'Ward', 'Community Area', 'Block',
+                 'Year', 'month', 'weekday', 'hour']
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Where the analytics run: 'pandas' holds the data in memory, 'duckdb' runs them
+# as SQL over the Parquet files and only pulls the aggregated results
+DATA_BACKEND = os.environ.get('CRIMES_DATA_BACKEND', 'pandas')
+
+# Set CRIMES_COMPACT_LOAD=0 to keep the frames with the dtypes they are stored with
+COMPACT_LOAD = os.environ.get('CRIMES_COMPACT_LOAD', '1') != '0'
+
+# Set CRIMES_LAZY_SECTIONS=0 to compute every section of a page up front
+LAZY_SECTIONS = os.environ.get('CRIMES_LAZY_SECTIONS', '1') != '0'
+
+# Rendering budget: bars per chart, the smallest categories beyond it are
+# folded into an "Other" bar, and rows per page of a table
+MAX_CHART_CATEGORIES = int(os.environ.get('CRIMES_MAX_CHART_CATEGORIES', '100'))
+TABLE_PAGE_SIZE = int(os.environ.get('CRIMES_TABLE_PAGE_SIZE', '25'))
+
+# Upper bound for the chart results kept by the view cache of each app process
+VIEW_CACHE_MAX_MB = int(os.environ.get('CRIMES_VIEW_CACHE_MAX_MB', '64'))
+
+def compact_frame(crimes_df):
+    # Downcast numbers to the smallest type holding their values and turn
+    # repetitive strings into categoricals
+    for column in crimes_df.columns:
+        series = crimes_df[column]
+        if not isinstance(series.dtype, np.dtype) or pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            crimes_df[column] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            crimes_df[column] = pd.to_numeric(series, downcast='float')
+        elif pd.api.types.is_object_dtype(series) and series.nunique() < len(series) / 2:
+            crimes_df[column] = series.astype('category')
+    return crimes_df
+
+def default_dtypes_memory(crimes_df):
+    # Bytes the frame would take with pandas' default int64/float64/object columns
+    memory = crimes_df.index.memory_usage()
+    for column in crimes_df.columns:
+        series = crimes_df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            value_counts = series.value_counts(sort=False, dropna=False)
+            memory += sum(count * (sys.getsizeof(value) + 8) for value, count in value_counts.items())
+        elif pd.api.types.is_bool_dtype(series):
+            memory += len(series)
+        else:
+            memory += 8 * len(series)
+    return memory
+
+def result_size(result):
+    memory = result.memory_usage(deep=True)
+    return int(memory.sum()) if isinstance(memory, pd.Series) else int(memory)
+
+class ViewCache:
+    # Least recently used chart results, shared by every session of the process
+    # and capped by their total size in memory
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.views = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.views:
+                self.views.move_to_end(key)
+                self.hits += 1
+                return self.views[key][0]
+            self.misses += 1
+
+        view = compute()
+        view_size = result_size(view)
+        with self.lock:
+            if key not in self.views and view_size <= self.max_bytes:
+                self.views[key] = (view, view_size)
+                self.size += view_size
+                while self.size > self.max_bytes:
+                    _, (_, evicted_size) = self.views.popitem(last=False)
+                    self.size -= evicted_size
+        return view
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'views': len(self.views), 'size': self.size, 'max_size': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+def get_data_version():
+    # Changes whenever the preprocessing rewrites or updates the store
+    if not os.path.exists(STATE_PATH):
+        return None
+    return load_state()['data_version']
+
+# The datasets are read-only and held once per process as shared resources
+# instead of a deserialized copy per session. Keying on the data version
+# reloads them after an update, max_entries drops the previous version.
+@instrumented(cached=True)
+@st.cache_resource(max_entries=1)
+def get_data(data_version):
+    record(cache_misses=1)
+    if DATA_BACKEND == 'duckdb':
+        return DuckDBBackend(os.path.join(OUTPUT_PATH, '[0-9]*.parquet'), ('crimes', data_version))
+    chicago_crimes_df = pd.read_parquet(OUTPUT_PATH, columns=APP_COLUMNS, memory_map=True)
+    record(rows_scanned=len(chicago_crimes_df))
+    if COMPACT_LOAD:
+        compact_frame(chicago_crimes_df)
+    return PandasBackend(chicago_crimes_df, ('crimes', data_version))
+
+@instrumented(cached=True)
+@st.cache_resource(max_entries=1)
+def get_crime_counts(data_version):
+    record(cache_misses=1)
+    crime_counts = open_crime_counts_cube(DATA_BACKEND, ('crime counts', data_version), compact_frame if COMPACT_LOAD else None)
+    if DATA_BACKEND != 'duckdb':
+        record(rows_scanned=crime_counts.rows)
+    return crime_counts
+
+@instrumented(cached=True)
+@st.cache_resource(max_entries=1)
+def get_hotspots(data_version):
+    record(cache_misses=1)
+    if DATA_BACKEND == 'duckdb':
+        return DuckDBBackend(HOTSPOTS_PATH, ('hotspots', data_version))
+    hotspots_df = pd.read_parquet(HOTSPOTS_PATH, memory_map=True)
+    record(rows_scanned=len(hotspots_df))
+    if COMPACT_LOAD:
+        compact_frame(hotspots_df)
+    return PandasBackend(hotspots_df, ('hotspots', data_version))
+
+@instrumented(cached=True)
+@st.cache_resource(max_entries=1)
+def get_crime_index(data_version):
+    record(cache_misses=1)
+    crimes_df = pd.read_parquet(OUTPUT_PATH, columns=INDEX_COLUMNS, memory_map=True)
+    record(rows_scanned=len(crimes_df))
+    if COMPACT_LOAD:
+        compact_frame(crimes_df)
+    return IndexedBackend(crimes_df, ('crimes', data_version), FILTER_COLUMNS)
+
+@st.cache_resource
+def get_view_cache():
+    return ViewCache(VIEW_CACHE_MAX_MB * 2**20)
+
+@st.cache_data
+def get_memory_footprint(data_version):
+    # Only the pandas backend holds the data in memory
+    memory_footprint = {}
+    for name, crimes in (('Crimes', get_data(data_version)), ('Crime counts', get_crime_counts(data_version)),
+                         ('Hotspots', get_hotspots(data_version))):
+        backends = [backend for _, _, backend in crimes.rollups] if isinstance(crimes, RollupBackend) else [crimes]
+        if all(isinstance(backend, PandasBackend) for backend in backends):
+            memory_footprint[name] = (sum(default_dtypes_memory(backend.crimes_df) for backend in backends),
+                                      sum(int(backend.crimes_df.memory_usage(deep=True).sum()) for backend in backends))
+    return memory_footprint
+
+start_run()
+data_version = get_data_version()
+chicago_crimes = get_data(data_version)
+crime_counts = get_crime_counts(data_version)
+hotspots = get_hotspots(data_version)
+# Years of the date range the hotspot map is counted over, None without a range
+hotspot_years = None
+
+def count_crimes_cached(crimes, keys, filters=None):
+    # Counts are kept in the view cache under the dataset (source and data
+    # version), the backend, the grouping keys and the filters
+    key = (crimes.view, crimes.name, tuple(keys) if isinstance(keys, list) else keys,
+           tuple((column, tuple(values)) for column, values in sorted((filters or {}).items())))
+    if not INSTRUMENTATION:
+        return get_view_cache().get_or_compute(key, lambda: crimes.count(keys, filters))
+
+    computed = []
+    def compute():
+        start = time.perf_counter()
+        computed.append(crimes.count(keys, filters))
+        record(query_seconds=time.perf_counter() - start)
+        return computed[0]
+    view = get_view_cache().get_or_compute(key, compute)
+    record(cache_hits=0 if computed else 1, cache_misses=1 if computed else 0, result_bytes=result_size(view))
+    return view
+
+class TimedPlotlyExpress:
+    # Stands in for plotly.express while instrumented, so the time spent
+    # building figures is recorded apart from counting and rendering them
+    def __init__(self, plotly_express):
+        self.plotly_express = plotly_express
+
+    def __getattr__(self, name):
+        build = getattr(self.plotly_express, name)
+
+        @functools.wraps(build)
+        def timed_build(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return build(*args, **kwargs)
+            finally:
+                record(figure_seconds=time.perf_counter() - start)
+        return timed_build
+
+if INSTRUMENTATION:
+    px = TimedPlotlyExpress(px)
+
+def plotly_chart(fig):
+    # Instrumented, the size of the figure's JSON is recorded and the Streamlit
+    # call, which serializes the figure and sends it, is timed on its own
+    if not INSTRUMENTATION:
+        return st.plotly_chart(fig)
+    record(payload_bytes=len(fig.to_json()))
+    start = time.perf_counter()
+    st.plotly_chart(fig)
+    record(render_seconds=time.perf_counter() - start)
+
+def pyplot(fig):
+    # Same for a Matplotlib figure, sent as a PNG rendered with Streamlit's settings
+    if not INSTRUMENTATION:
+        return st.pyplot(fig)
+    image = io.BytesIO()
+    fig.savefig(image, bbox_inches='tight', dpi=200, format='png')
+    record(payload_bytes=image.tell())
+    start = time.perf_counter()
+    st.pyplot(fig)
+    record(render_seconds=time.perf_counter() - start)
+
+def no_crimes(counts):
+    # The sidebar filters may select no crime at all, a chart then says so instead of failing
+    if len(counts):
+        return False
+    st.info("No crimes match the selected filters")
+    return True
+
+def render_sections(sections):
+    # The first section of a page is shown right away, the others are only
+    # computed once the user asks for them
+    for index, (title, render) in enumerate(sections):
+        st.write(f"<h3>{title}</h3>", unsafe_allow_html=True)
+        if not LAZY_SECTIONS or index == 0 or st.checkbox("Show chart", key=f"show_section_{title}"):
+            render()
+
+def limit_categories(counts_df, category, value_columns=('Count',)):
+    # Keeps the largest categories and folds the rest into an "Other" bar, so the
+    # chart sent to the browser stays bounded however many categories there are
+    if len(counts_df) <= MAX_CHART_CATEGORIES:
+        return counts_df
+    value_columns = list(value_columns)
+    ranked_df = counts_df.iloc[counts_df[value_columns].sum(axis=1).argsort()[::-1]]
+    other_df = pd.DataFrame([{category: 'Other', **ranked_df.iloc[MAX_CHART_CATEGORIES - 1:][value_columns].sum().to_dict()}])
+    return pd.concat([ranked_df.iloc[:MAX_CHART_CATEGORIES - 1], other_df], ignore_index=True)
+
+def paginated_table(table_df, key):
+    page_count = max((len(table_df) - 1) // TABLE_PAGE_SIZE + 1, 1)
+    page = 1
+    if page_count > 1:
+        page = st.number_input(f'Page (of {page_count})', min_value=1, max_value=page_count, value=1, key=f"table_page_{key}")
+    start = (page - 1) * TABLE_PAGE_SIZE
+    st.dataframe(table_df.iloc[start:start + TABLE_PAGE_SIZE], hide_index=True)
 
 def textual_definitions():
     st.write("<h3>Dataset Description</h3>", unsafe_allow_html=True)
@@ -70,7 +347,8 @@ def textual_definitions():
         avoid inaccurate results:</p>
         
         <p>Null values in location-related columns are replaced with the keyword "not specified" since specific
-        locations of incidents are not provided in the dataset.</p>
+        locations of incidents are not provided in the dataset. Missing latitude and longitude values are kept as nulls
+        so the coordinate columns stay numeric.</p>
         
         <p>Null values in the 'ward' and 'community area' columns (float data type columns) are replaced using the
         following techniques:</p>
@@ -89,20 +367,27 @@ def textual_definitions():
         ''', unsafe_allow_html=True)
         
 
-def crime_types_pie_chart(chicago_crimes_df):
-    primary_type_counts = chicago_crimes_df['Primary Type'].value_counts().iloc[:10]
+@instrumented()
+def crime_types_pie_chart(crimes):
+    primary_type_counts = count_crimes_cached(crimes, 'Primary Type').sort_values(ascending=False).iloc[:10]
+    if no_crimes(primary_type_counts):
+        return
     fig, ax = plt.subplots(figsize=(10, 10))
     ax.pie(primary_type_counts, labels=primary_type_counts.index, autopct='%1.1f%%', startangle=140)
     ax.axis('equal')
     ax.set_title('Top 10 Crime Distributions')
     fig.patch.set_facecolor('lightgrey')
-    st.pyplot(fig)
+    pyplot(fig)
 
-def crimes_with_arrest_or_domestic(chicago_crimes_df, count_rate):
-    crime_counts = chicago_crimes_df.groupby(['Primary Type', count_rate]).size().reset_index(name='Count')
+@instrumented()
+def crimes_with_arrest_or_domestic(crimes, count_rate):
+    crime_counts = count_crimes_cached(crimes, ['Primary Type', count_rate]).reset_index(name='Count')
+    if no_crimes(crime_counts):
+        return
     true_crimes = crime_counts[crime_counts[count_rate] == True]
     false_crimes = crime_counts[crime_counts[count_rate] == False]
     merged_crimes = true_crimes.merge(false_crimes, on='Primary Type', suffixes=(f'_{count_rate}', f'_Non-{count_rate}'))
+    merged_crimes = limit_categories(merged_crimes, 'Primary Type', [f'Count_{count_rate}', f'Count_Non-{count_rate}'])
     fig_count_rate_type = px.bar(merged_crimes, 
                 x='Primary Type', y=f'Count_{count_rate}', 
                 title=f'Major Numbers of {count_rate} Crimes by types',
@@ -114,11 +399,14 @@ def crimes_with_arrest_or_domestic(chicago_crimes_df, count_rate):
                 name=f'Non-{count_rate}', marker_color='red')
 
     fig_count_rate_type.update_layout(barmode='stack', xaxis_tickangle=-45)
-    st.plotly_chart(fig_count_rate_type)
-
-def crime_by_area_type(chicago_crimes_df, area_type):
-    crime_by_area = chicago_crimes_df.groupby(area_type).size().reset_index(name='Count')
-    crime_by_area_sorted = crime_by_area.sort_values(by='Count', ascending=False)
+    plotly_chart(fig_count_rate_type)
+
+@instrumented()
+def crime_by_area_type(crimes, area_type):
+    crime_by_area = count_crimes_cached(crimes, area_type).reset_index(name='Count')
+    if no_crimes(crime_by_area):
+        return
+    crime_by_area_sorted = limit_categories(crime_by_area.sort_values(by='Count', ascending=False), area_type)
     fig_by_area_type = px.bar(
     crime_by_area_sorted,
     x=area_type,
@@ -128,30 +416,37 @@ def crime_by_area_type(chicago_crimes_df, area_type):
     height=600
     )
     fig_by_area_type.update_layout(xaxis_tickangle=-45)
-    st.plotly_chart(fig_by_area_type)
+    plotly_chart(fig_by_area_type)
 
-def crimes_by_area_with_type(chicago_crimes_df, area,type):
-    crime_counts = chicago_crimes_df.groupby([area, type]).size().reset_index(name='Count')
+@instrumented()
+def crimes_by_area_with_type(crimes, area,type):
+    crime_counts = count_crimes_cached(crimes, [area, type]).reset_index(name='Count')
+    if no_crimes(crime_counts):
+        return
     grouped_df = crime_counts.groupby(area)['Count'].sum().reset_index(name='Count')
     sorted_df = grouped_df.sort_values(by='Count', ascending=False)
-    sorted_df
+    paginated_table(sorted_df, f"{area}_{type}")
 
     selected_area = st.selectbox(f'Select an {area} no.', tuple(sorted_df[area].tolist()),key=f"select_box_{area}_{type}")
 
     fig_name = f'fig_{selected_area}'
     area_number = crime_counts[crime_counts[area] == selected_area]
     temp = (area_number[area].iloc[0])
+    area_number = limit_categories(area_number, type)
     fig_name = px.bar(area_number, x=type, y='Count', title=f'{area} "{temp}" by {type}', width=1000, height=600)
     fig_name.update_layout(xaxis_tickangle=-45)
-    st.plotly_chart(fig_name)
+    plotly_chart(fig_name)
 
 
-def crimes_depatments_aresst_rate(chicago_crimes_df, team):
-    crime_counts_by_District = chicago_crimes_df.groupby(team).size().reset_index(name='Crime_Count')
+@instrumented()
+def crimes_depatments_aresst_rate(crimes, team):
+    crime_counts_by_District = count_crimes_cached(crimes, team).reset_index(name='Crime_Count')
+    if no_crimes(crime_counts_by_District):
+        return
     crime_counts_by_District = crime_counts_by_District.sort_values(by='Crime_Count', ascending=False)
     top_10_Districts = crime_counts_by_District.head(10)
-    arrest_counts_by_District_top_10 = chicago_crimes_df[chicago_crimes_df[team].isin(top_10_Districts[team])]
-    arrest_counts_by_District = arrest_counts_by_District_top_10.groupby([team, 'Arrest']).size().reset_index(name='Arrest_Count')
+    arrest_counts_by_District = count_crimes_cached(crimes, [team, 'Arrest']).reset_index(name='Arrest_Count')
+    arrest_counts_by_District = arrest_counts_by_District[arrest_counts_by_District[team].isin(top_10_Districts[team])]
     fig = px.bar(arrest_counts_by_District, x=team, y='Arrest_Count', color='Arrest',
                 labels={team: team, 'Arrest_Count': 'Count'},
                 title=f'{team} wise Crime Counts with Arrests and Non-Arrests',
@@ -159,12 +454,14 @@ def crimes_depatments_aresst_rate(chicago_crimes_df, team):
                 color_discrete_map={'True': 'blue', 'False': 'red'})
     fig.update_traces(marker_line_width=0)
     fig.update_layout(xaxis_title=team, yaxis_title='Count', legend_title='Arrest')
-    st.plotly_chart(fig)
+    plotly_chart(fig)
 
 
-def crimes_by_year(chicago_crimes_df):
-    df_year_wise = chicago_crimes_df['Date'].dt.year
-    year_counts = df_year_wise .value_counts().sort_index()
+@instrumented()
+def crimes_by_year(crimes):
+    year_counts = count_crimes_cached(crimes, 'Year').sort_index()
+    if no_crimes(year_counts):
+        return
     fig_name = px.bar(
         x=year_counts.index,
         y=year_counts.values,
@@ -176,11 +473,13 @@ def crimes_by_year(chicago_crimes_df):
     )
     fig_name.update_layout(xaxis_tickangle=-45)
 
-    st.plotly_chart(fig_name)
+    plotly_chart(fig_name)
 
-def crimes_by_month(chicago_crimes_df):
-    df_month_wise = chicago_crimes_df['Date'].dt.month
-    month_counts = df_month_wise .value_counts().sort_index()
+@instrumented()
+def crimes_by_month(crimes):
+    month_counts = count_crimes_cached(crimes, 'month').sort_index()
+    if no_crimes(month_counts):
+        return
     fig_name = px.bar(
     x=month_counts.index,
     y=month_counts.values,
@@ -191,14 +490,19 @@ def crimes_by_month(chicago_crimes_df):
     height=800
     )
     month_names = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
-    fig_name.update_xaxes(type='category', tickmode='array', tickvals=month_counts.index, ticktext=month_names, tickangle=-45)
+    # A date range may leave some months out, each bar is labelled with its own month
+    fig_name.update_xaxes(type='category', tickmode='array', tickvals=month_counts.index,
+                          ticktext=[month_names[month - 1] for month in month_counts.index], tickangle=-45)
 
-    st.plotly_chart(fig_name)
+    plotly_chart(fig_name)
     
 
-def crimes_by_day(chicago_crimes_df):
-    crime_in_chicago_df_day_name = chicago_crimes_df['Date'].dt.strftime('%A')
-    day_counts = crime_in_chicago_df_day_name.value_counts()
+@instrumented()
+def crimes_by_day(crimes):
+    day_counts = count_crimes_cached(crimes, 'weekday').sort_index()
+    if no_crimes(day_counts):
+        return
+    day_counts.index = [DAY_NAMES[weekday] for weekday in day_counts.index]
     fig_name = px.bar(
         x=day_counts.index,
         y=day_counts.values,
@@ -208,16 +512,18 @@ def crimes_by_day(chicago_crimes_df):
         width=1000,
         height=800
     )
-    day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    fig_name.update_xaxes(type='category', tickmode='array', tickvals=day_names, ticktext=day_names, tickangle=-45)
-    fig_name.update_yaxes(range=[1000000, 1200000])
-    st.plotly_chart(fig_name)
+    fig_name.update_xaxes(type='category', tickmode='array', tickvals=DAY_NAMES, ticktext=DAY_NAMES, tickangle=-45)
+    # Zoom in on the differences between the days, whatever the filters leave
+    fig_name.update_yaxes(range=[day_counts.min() * 0.9, day_counts.max() * 1.02])
+    plotly_chart(fig_name)
     
 
-def crimes_by_hour(chicago_crimes_df):
-    chicago_crimes_df_time = chicago_crimes_df['Date'].dt.strftime('%H')
-    time_counts = chicago_crimes_df_time.value_counts()
-    time_counts = time_counts.sort_index()
+@instrumented()
+def crimes_by_hour(crimes):
+    time_counts = count_crimes_cached(crimes, 'hour').sort_index()
+    if no_crimes(time_counts):
+        return
+    time_counts.index = [f"{hour:02d}" for hour in time_counts.index]
     fig = px.bar(
         x=time_counts.index,
         y=time_counts.values,
@@ -227,20 +533,66 @@ def crimes_by_hour(chicago_crimes_df):
         width=1000,
         height=800
     )
-    st.plotly_chart(fig)
+    plotly_chart(fig)
+
+
+@instrumented()
+def crimes_by_hour_and_day(crimes):
+    # A 7x24 grid whatever the size of the data, hours without crimes count zero
+    hour_day_counts = count_crimes_cached(crimes, ['weekday', 'hour']).unstack(fill_value=0)
+    if no_crimes(hour_day_counts):
+        return
+    hour_day_counts = hour_day_counts.reindex(index=range(7), columns=range(24), fill_value=0)
+    fig = px.imshow(
+        hour_day_counts.values,
+        x=[f"{hour:02d}" for hour in hour_day_counts.columns],
+        y=DAY_NAMES,
+        labels={'x': 'Hour', 'y': 'Day', 'color': 'Count'},
+        title='Occurrences of Crimes by Hour and Day',
+        color_continuous_scale='Reds',
+        aspect='auto',
+        width=1000,
+        height=600
+    )
+    plotly_chart(fig)
     
+@instrumented()
+def crime_hotspots_map(crimes):
+    cell_counts = count_crimes_cached(crimes, 'Geohash').reset_index(name='Count')
+    if no_crimes(cell_counts):
+        return
+    cell_counts['Geohash'] = cell_counts['Geohash'].astype(str)
+    # Every stored count holds at least HOTSPOT_MIN_COUNT crimes, so every cell does too
+    shown_cells = cell_counts.sort_values(by='Count', ascending=False)
+    shown_cells['Latitude'], shown_cells['Longitude'] = geohash_centers(shown_cells['Geohash'])
+    fig = px.density_mapbox(
+        shown_cells,
+        lat='Latitude',
+        lon='Longitude',
+        z='Count',
+        radius=15,
+        center={'lat': 41.84, 'lon': -87.68},
+        zoom=9.5,
+        mapbox_style='open-street-map',
+        title='Density of Crimes',
+        width=1000,
+        height=800
+    )
+    plotly_chart(fig)
+    st.caption(f"So that no group of fewer than {HOTSPOT_MIN_COUNT} crimes can be singled out, smaller groups are merged "
+               "across arrest and domestic, then crime type, district and year until they reach it. A filter on a merged "
+               f"column leaves them out, and cells with fewer than {HOTSPOT_MIN_COUNT} crimes in total are not stored.")
+    paginated_table(shown_cells[['Geohash', 'Latitude', 'Longitude', 'Count']].round(4), "hotspot_cells")
+
 def basics():
 
     textual_definitions()
 
-    st.write('<h3>Crime types distributions</h3>',  unsafe_allow_html=True)
-    crime_types_pie_chart(chicago_crimes_df)
-
-    st.write('<h3>Crime Counts by Domestic vs Non-Domestic</h3>',  unsafe_allow_html=True)
-    crimes_with_arrest_or_domestic(chicago_crimes_df,"Domestic")
-
-    st.write('<h3>Crime Counts by Arrest vs Non-Arrest</h3>',  unsafe_allow_html=True)
-    crimes_with_arrest_or_domestic(chicago_crimes_df,"Arrest")
+    render_sections([
+        ('Crime types distributions', lambda: crime_types_pie_chart(crime_counts)),
+        ('Crime Counts by Domestic vs Non-Domestic', lambda: crimes_with_arrest_or_domestic(crime_counts,"Domestic")),
+        ('Crime Counts by Arrest vs Non-Arrest', lambda: crimes_with_arrest_or_domestic(crime_counts,"Arrest")),
+    ])
 
 
 def crimes_by_police_deparements():
@@ -265,17 +617,12 @@ def crimes_by_police_deparements():
         </ul>
         ''', unsafe_allow_html=True)
 
-    st.write("<h3>Police Districts having major crimes with their type</h3>", unsafe_allow_html=True)
-    crimes_by_area_with_type(chicago_crimes_df, "District", "Primary Type")
-
-    st.write("<h3>Police Districts having major crimes beat wise</h3>", unsafe_allow_html=True)
-    crimes_by_area_with_type(chicago_crimes_df, "District", "Beat")
-
-    st.write("<h3>Police Districts arrest rate</h3>", unsafe_allow_html=True)
-    crimes_depatments_aresst_rate(chicago_crimes_df, "District")
-
-    st.write("<h3>Police Beat arrest rate</h3>", unsafe_allow_html=True)
-    crimes_depatments_aresst_rate(chicago_crimes_df, "Beat")
+    render_sections([
+        ('Police Districts having major crimes with their type', lambda: crimes_by_area_with_type(crime_counts, "District", "Primary Type")),
+        ('Police Districts having major crimes beat wise', lambda: crimes_by_area_with_type(crime_counts, "District", "Beat")),
+        ('Police Districts arrest rate', lambda: crimes_depatments_aresst_rate(crime_counts, "District")),
+        ('Police Beat arrest rate', lambda: crimes_depatments_aresst_rate(crime_counts, "Beat")),
+    ])
 
 
 def crimes_by_chicago_areas():
@@ -303,6 +650,15 @@ def crimes_by_chicago_areas():
        
         ''', unsafe_allow_html=True)
 
+    render_sections([
+        ('Crime frequency by area', crimes_by_selected_area),
+        ('Community areas having major crimes with their type', lambda: crimes_by_area_with_type(crime_counts, "Community Area", "Primary Type")),
+        ('Ward areas having major crimes with their type', lambda: crimes_by_area_with_type(crime_counts, "Ward", "Primary Type")),
+        ('Community areas having major crimes block wise', lambda: crimes_by_area_with_type(chicago_crimes, "Community Area", "Block")),
+        ('Ward having major crimes block wise', lambda: crimes_by_area_with_type(chicago_crimes, "Ward", "Block")),
+    ])
+
+def crimes_by_selected_area():
     areas = {
     "Community Area": crime_by_area_type,
     "Ward": crime_by_area_type,
@@ -310,22 +666,9 @@ def crimes_by_chicago_areas():
 
     selected_area = st.selectbox('Select an area:', tuple(areas.keys()), key=f"select_box_crime_area")
     if selected_area == "Ward":
-        areas[selected_area](chicago_crimes_df, "Ward")
+        areas[selected_area](crime_counts, "Ward")
     else:
-        areas[selected_area](chicago_crimes_df, "Community Area")
-
-
-    st.write("<h3>Community areas having major crimes with their type</h3>", unsafe_allow_html=True)
-    crimes_by_area_with_type(chicago_crimes_df, "Community Area", "Primary Type")
-
-    st.write("<h3>Ward areas having major crimes with their type</h3>", unsafe_allow_html=True)
-    crimes_by_area_with_type(chicago_crimes_df, "Ward", "Primary Type")
-
-    st.write("<h3>Community areas having major crimes block wise</h3>", unsafe_allow_html=True)
-    crimes_by_area_with_type(chicago_crimes_df, "Community Area", "Block")
-
-    st.write("<h3>Ward having major crimes block wise</h3>", unsafe_allow_html=True)
-    crimes_by_area_with_type(chicago_crimes_df, "Ward", "Block")
+        areas[selected_area](crime_counts, "Community Area")
 
 def crimes_by_time():
     st.write("<h3>Crimes Analytics by time</h3>", unsafe_allow_html=True)
@@ -351,10 +694,97 @@ def crimes_by_time():
     
         ''', unsafe_allow_html=True)
 
-    crimes_by_year(chicago_crimes_df)
-    crimes_by_month(chicago_crimes_df)
-    crimes_by_day(chicago_crimes_df)
-    crimes_by_hour(chicago_crimes_df)
+    render_sections([
+        ('Crimes by year', lambda: crimes_by_year(crime_counts)),
+        ('Crimes by month', lambda: crimes_by_month(crime_counts)),
+        ('Crimes by day', lambda: crimes_by_day(crime_counts)),
+        ('Crimes by hour', lambda: crimes_by_hour(crime_counts)),
+        ('Crimes by hour and day', lambda: crimes_by_hour_and_day(crime_counts)),
+    ])
+
+def crimes_hotspots():
+    st.write("<h3>Crime Hotspots</h3>", unsafe_allow_html=True)
+    st.write("<h4>Analytics Use Cases</h4>", unsafe_allow_html=True)
+    st.write('''
+        <p>The map shows where crimes concentrate across the city, counted per cell of about 0.9 by 0.6 km. 
+        With the filters of the sidebar, beat teams can find the hotspots of a crime type, of a district or of 
+        the crimes without an arrest, and plan their patrols around them.</p>
+        ''', unsafe_allow_html=True)
+
+    if hotspot_years is not None:
+        # The index has no finer date than the year, the map says so rather than widen the range silently
+        years = str(hotspot_years[0]) if len(hotspot_years) == 1 else f"{hotspot_years[0]} to {hotspot_years[-1]}"
+        st.caption(f"The hotspot index is counted per year, so the map covers the whole of {years}, "
+                   "not only the selected dates.")
+    render_sections([
+        ('Crime density by area', lambda: crime_hotspots_map(hotspots)),
+    ])
+
+def global_filters():
+    st.sidebar.title("Filters")
+    years = count_crimes_cached(crime_counts, 'Year').index
+    first_day, last_day = pd.Timestamp(int(years.min()), 1, 1).date(), pd.Timestamp(int(years.max()), 12, 31).date()
+    selected_dates = st.sidebar.date_input("Date range", value=(first_day, last_day), min_value=first_day,
+                                           max_value=last_day, key="filter_date_range")
+    primary_types = st.sidebar.multiselect("Crime type", sorted(count_crimes_cached(crime_counts, 'Primary Type').index.astype(str)),
+                                           key="filter_primary_type")
+    districts = st.sidebar.multiselect("District", count_crimes_cached(crime_counts, 'District').index.tolist(), key="filter_district")
+    arrest = st.sidebar.selectbox("Arrest", ("All", "Yes", "No"), key="filter_arrest")
+    domestic = st.sidebar.selectbox("Domestic", ("All", "Yes", "No"), key="filter_domestic")
+
+    filters = {}
+    if primary_types:
+        filters['Primary Type'] = primary_types
+    if districts:
+        filters['District'] = districts
+    if arrest != "All":
+        filters['Arrest'] = [arrest == "Yes"]
+    if domestic != "All":
+        filters['Domestic'] = [domestic == "Yes"]
+
+    # The end of the range is exclusive, a range still being picked has one date only
+    date_range = None
+    if len(selected_dates) == 2 and tuple(selected_dates) != (first_day, last_day):
+        date_range = (pd.Timestamp(selected_dates[0]), pd.Timestamp(selected_dates[1]) + pd.Timedelta(days=1))
+    return filters, date_range
+
+def apply_global_filters(filters, date_range):
+    # Every filter column is a cube dimension, so without a date range the cube
+    # still serves its charts. The individual crimes come from the filter index,
+    # or straight from the Parquet store with DuckDB.
+    global chicago_crimes, crime_counts, hotspots, hotspot_years
+    if not filters and date_range is None:
+        return
+    filtered_source = get_data(data_version) if DATA_BACKEND == 'duckdb' else get_crime_index(data_version)
+    chicago_crimes = FilteredBackend(filtered_source, filters, date_range)
+    crime_counts = FilteredBackend(crime_counts if date_range is None else filtered_source, filters, date_range)
+    # The hotspot index is counted per year, a date range selects the years it overlaps
+    hotspot_filters = dict(filters)
+    if date_range is not None:
+        hotspot_years = list(range(date_range[0].year, (date_range[1] - pd.Timedelta(days=1)).year + 1))
+        hotspot_filters['Year'] = hotspot_years
+    hotspots = FilteredBackend(hotspots, hotspot_filters)
+
+def instrumentation_panel():
+    # Measurements of this run, drawn last so they cover the page
+    measurements_df = pd.DataFrame(run_records(), columns=['name', 'seconds', 'query_seconds', 'figure_seconds',
+                                                           'render_seconds', 'rows_scanned', 'result_bytes',
+                                                           'payload_bytes', 'peak_bytes', 'cache_hits', 'cache_misses'])
+    st.sidebar.title("Instrumentation")
+    st.sidebar.dataframe(pd.DataFrame({
+        'Function': measurements_df['name'],
+        'Time (ms)': (measurements_df['seconds'] * 1000).round(1),
+        'Counting (ms)': (measurements_df['query_seconds'] * 1000).round(1),
+        'Figure (ms)': (measurements_df['figure_seconds'] * 1000).round(1),
+        'Rendering (ms)': (measurements_df['render_seconds'] * 1000).round(1),
+        'Rows scanned': measurements_df['rows_scanned'],
+        'Result (KB)': (measurements_df['result_bytes'] / 2**10).round(1),
+        'Chart (KB)': (measurements_df['payload_bytes'] / 2**10).round(1),
+        'Peak memory (MB)': (measurements_df['peak_bytes'] / 2**20).round(1),
+        'Cache hits': measurements_df['cache_hits'],
+        'Cache misses': measurements_df['cache_misses'],
+    }), hide_index=True)
+    export_metrics()
 
 def main():
     st.title("Chicago Crimes Analytics")
@@ -364,11 +794,25 @@ def main():
     "Crimes by Departments": crimes_by_police_deparements,
     "Crimes by Areas": crimes_by_chicago_areas,
     "Crimes by Time": crimes_by_time,
+    "Crime Hotspots": crimes_hotspots,
     }
 
     st.sidebar.title("Navigation")
     selected_page = st.sidebar.selectbox("Go to", tuple(pages.keys()), key="select box page switch")
+    apply_global_filters(*global_filters())
+
+    st.sidebar.title("Memory footprint")
+    for name, (default_memory, loaded_memory) in get_memory_footprint(data_version).items():
+        st.sidebar.caption(f"{name}: {loaded_memory / 2**20:.1f} MB loaded, {default_memory / 2**20:.1f} MB with default dtypes")
+    view_cache_stats = get_view_cache().stats()
+    st.sidebar.caption(f"View cache: {view_cache_stats['views']} views, "
+                       f"{view_cache_stats['size'] / 2**20:.1f} of {view_cache_stats['max_size'] / 2**20:.0f} MB, "
+                       f"hit rate {view_cache_stats['hit_rate']:.0%} ({view_cache_stats['hits']} hits, {view_cache_stats['misses']} misses)")
+
     pages[selected_page]()
 
+    if INSTRUMENTATION:
+        instrumentation_panel()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from crimes_preprocessed import CUBE_ROLLUPS, rollup_path
+from instrumentation import record
+
+def count_crimes(crimes_df, keys):
+    # Sums the materialized counts of the cube, or counts the rows of the raw frame
+    grouped = crimes_df.groupby(keys, observed=True)
+    if 'Count' in crimes_df.columns:
+        return grouped['Count'].sum()
+    return grouped.size()
+
+
+def filter_crimes(crimes_df, filters, date_range=None):
+    # date_range is a (start, end) pair of timestamps, the end is exclusive
+    if date_range is not None:
+        crimes_df = crimes_df[(crimes_df['Date'] >= date_range[0]) & (crimes_df['Date'] < date_range[1])]
+    for column, values in (filters or {}).items():
+        crimes_df = crimes_df[crimes_df[column].isin(values)]
+    return crimes_df
+
+
+def quote_identifier(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def python_value(value):
+    # DuckDB binds Python scalars, not numpy ones
+    return value.item() if hasattr(value, 'item') else value
+
+
+class PandasBackend:
+    # Reference backend: the dataset is a DataFrame held in memory
+    name = 'pandas'
+
+    def __init__(self, crimes_df, view):
+        self.crimes_df = crimes_df
+        self.view = view
+
+    def count(self, keys, filters=None, date_range=None):
+        selected_df = filter_crimes(self.crimes_df, filters, date_range)
+        record(rows_scanned=len(selected_df))
+        return count_crimes(selected_df, keys)
+
+
+class IndexedBackend:
+    # Individual crimes sorted by date, with a packed bitmap of the matching rows
+    # for every value of the bitmap columns. A date range is two binary searches,
+    # the other filters OR the bitmaps of their values and AND the columns, so a
+    # selection never masks the whole frame.
+    name = 'index'
+
+    def __init__(self, crimes_df, view, bitmap_columns):
+        order = np.argsort(crimes_df['Date'].to_numpy(), kind='stable')
+        self.crimes_df = crimes_df.iloc[order].reset_index(drop=True)
+        self.dates = self.crimes_df['Date'].to_numpy()
+        self.bitmaps = {}
+        for column in bitmap_columns:
+            series = self.crimes_df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Compare the small category codes rather than the strings
+                codes = series.cat.codes.to_numpy()
+                self.bitmaps[column] = {series.cat.categories[code]: np.packbits(codes == code) for code in np.unique(codes) if code >= 0}
+            else:
+                values = series.to_numpy()
+                self.bitmaps[column] = {value: np.packbits(values == value) for value in pd.unique(values).tolist()}
+        self.view = view
+
+    def select(self, filters=None, date_range=None, columns=None):
+        # With columns, only those and the columns still to filter on are taken
+        # out of the frame, not every column of the selected rows
+        start, end = 0, len(self.dates)
+        if date_range is not None:
+            start = np.searchsorted(self.dates, np.datetime64(date_range[0]), side='left')
+            end = np.searchsorted(self.dates, np.datetime64(date_range[1]), side='left')
+
+        bitmap = None
+        other_filters = {}
+        for column, values in (filters or {}).items():
+            if column not in self.bitmaps:
+                other_filters[column] = values
+                continue
+            column_bitmap = np.zeros((len(self.dates) + 7) // 8, dtype=np.uint8)
+            for value in values:
+                if value in self.bitmaps[column]:
+                    column_bitmap |= self.bitmaps[column][value]
+            bitmap = column_bitmap if bitmap is None else bitmap & column_bitmap
+
+        if bitmap is None:
+            rows = slice(start, end)
+        else:
+            # Only the bytes covering the date range are unpacked
+            first_byte = start // 8
+            selected = np.unpackbits(bitmap[first_byte:(end + 7) // 8])[start - first_byte * 8:end - first_byte * 8]
+            rows = np.flatnonzero(selected) + start
+        if columns is None:
+            selected_df = self.crimes_df.iloc[rows]
+        else:
+            columns = list(dict.fromkeys(list(columns) + list(other_filters)))
+            selected_df = pd.DataFrame({column: self.crimes_df[column].iloc[rows] for column in columns})
+        return filter_crimes(selected_df, other_filters)
+
+    def count(self, keys, filters=None, date_range=None):
+        selected_df = self.select(filters, date_range, [keys] if isinstance(keys, str) else keys)
+        record(rows_scanned=len(selected_df))
+        return count_crimes(selected_df, keys)
+
+
+class FilteredBackend:
+    # Applies the dashboard's global filters to every count of a backend
+    def __init__(self, backend, filters, date_range=None):
+        self.backend = backend
+        self.filters = filters
+        self.date_range = date_range
+        self.name = backend.name
+        self.view = (backend.view, tuple((column, tuple(values)) for column, values in sorted(filters.items())), date_range)
+
+    def count(self, keys, filters=None, date_range=None):
+        return self.backend.count(keys, {**self.filters, **(filters or {})}, self.date_range)
+
+
+class DuckDBBackend:
+    # Pushes the group-bys and filters down into SQL over the Parquet files,
+    # only the aggregated result is pulled into pandas
+    name = 'duckdb'
+
+    def __init__(self, parquet_path, view):
+        import duckdb
+
+        self.connection = duckdb.connect()
+        self.source = "read_parquet('" + parquet_path.replace("'", "''") + "')"
+        self.columns = self.connection.execute(f"DESCRIBE SELECT * FROM {self.source}").df()['column_name'].tolist()
+        self.view = view
+
+    def count(self, keys, filters=None, date_range=None):
+        key_columns = [keys] if isinstance(keys, str) else list(keys)
+        key_sql = ', '.join(quote_identifier(column) for column in key_columns)
+        count_sql = 'CAST(SUM("Count") AS BIGINT)' if 'Count' in self.columns else 'COUNT(*)'
+
+        # Like pandas' groupby in the reference backend, rows with a missing key are dropped
+        conditions = [f"{quote_identifier(column)} IS NOT NULL" for column in key_columns]
+        parameters = []
+        if date_range is not None:
+            conditions.append('"Date" >= ? AND "Date" < ?')
+            parameters.extend(pd.Timestamp(bound).to_pydatetime() for bound in date_range)
+        for column, values in (filters or {}).items():
+            values = [python_value(value) for value in values]
+            if not values:
+                conditions.append('FALSE')
+                continue
+            conditions.append(f"{quote_identifier(column)} IN ({', '.join('?' * len(values))})")
+            parameters.extend(values)
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        query = (f"SELECT {key_sql}, {count_sql} AS crime_count, COUNT(*) AS scanned_rows FROM {self.source} {where_sql} "
+                 f"GROUP BY {key_sql} ORDER BY {key_sql}")
+        # A cursor per query, the connection is shared by the sessions' threads
+        counts_df = self.connection.cursor().execute(query, parameters).df()
+        record(rows_scanned=int(counts_df['scanned_rows'].sum()))
+        return counts_df.set_index(key_columns if len(key_columns) > 1 else key_columns[0])['crime_count'].rename(None)
+
+
+class RollupBackend:
+    # The rollups of the crime counts cube, every count is served by the
+    # smallest rollup holding its keys and filter columns
+    def __init__(self, rollups, view):
+        # rollups are (dimensions, rows, backend) triples
+        self.rollups = sorted(rollups, key=lambda rollup: rollup[1])
+        self.rows = sum(rows for _, rows, _ in self.rollups)
+        self.name = self.rollups[0][2].name
+        self.view = view
+
+    def rollup(self, keys, filters=None):
+        columns = set([keys] if isinstance(keys, str) else keys) | set(filters or {})
+        for dimensions, _, backend in self.rollups:
+            if columns <= set(dimensions):
+                return backend
+        raise KeyError(f"no rollup of the crime counts cube holds {sorted(columns)}")
+
+    def count(self, keys, filters=None, date_range=None):
+        return self.rollup(keys, filters).count(keys, filters, date_range)
+
+
+def open_crime_counts_cube(backend_name, view, prepare_frame=None):
+    # DuckDB queries the rollup files in place, pandas loads them into memory
+    rollups = []
+    for name, dimensions in CUBE_ROLLUPS.items():
+        if backend_name == 'duckdb':
+            backend = DuckDBBackend(rollup_path(name), view)
+            rows = pq.ParquetFile(rollup_path(name)).metadata.num_rows
+        else:
+            crime_counts_df = pd.read_parquet(rollup_path(name), memory_map=True)
+            if prepare_frame is not None:
+                prepare_frame(crime_counts_df)
+            backend = PandasBackend(crime_counts_df, view)
+            rows = len(crime_counts_df)
+        rollups.append((dimensions, rows, backend))
+    return RollupBackend(rollups, view)
@@ -1,27 +1,744 @@
+import argparse
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RAW_DATA_PATH = 'Crimes_-_2001_to_Present.csv'
+# One Parquet file per year of the crime date, so an update only rewrites the years it touches
+OUTPUT_PATH = "preprocessed_crimes"
+# One Parquet file per rollup of the crime counts cube
+CUBE_PATH = "crime_counts_cube"
+HOTSPOTS_PATH = "crime_hotspots.parquet"
+# The hotspot counts before suppression, kept additive for the updates
+HOTSPOT_COUNTS_PATH = "crime_hotspots_counts.parquet"
+MAPPINGS_PATH = "block_mappings.parquet"
+STATE_PATH = "preprocessing_state.json"
+
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+DATE_COLUMNS = ['Date', 'Updated On']
+
+COLUMNS_TO_DROP = ['Case Number', 'IUCR', 'Description', 'FBI Code', 'X Coordinate',
+                   'Y Coordinate', 'Location', ]
+
+# Pin the dtypes pandas would infer over the whole file, so a chunk without nulls
+# in these columns is not read (and written) as int instead of float.
+RAW_DTYPES = {'District': 'float64', 'Ward': 'float64', 'Community Area': 'float64',
+              'Latitude': 'float64', 'Longitude': 'float64', 'Location Description': 'object'}
+
+# Columns whose nulls are filled from the value the same block was reported with
+BLOCK_IMPUTED_COLUMNS = ['Community Area', 'Ward']
+MAPPING_COLUMNS = ['Block'] + BLOCK_IMPUTED_COLUMNS
+
+# Column types of the preprocessed store, nulls are filled before the casts
+CATEGORY_COLUMNS = ['Primary Type', 'Block', 'Location Description']
+COLUMN_DTYPES = {'ID': 'int32', 'Beat': 'int16', 'District': 'int8', 'Ward': 'int8',
+                 'Community Area': 'int8', 'Year': 'int16', 'Arrest': 'bool', 'Domestic': 'bool',
+                 'Latitude': 'Float64', 'Longitude': 'Float64'}
+
+# Calendar features of the crime date, derived once here as small ints so the
+# app never extracts them from the timestamps again. The year is the dataset's
+# own 'Year' column, weekday is 0 for Monday and week_of_year is the ISO week.
+CALENDAR_FEATURES = {'month': 'int8', 'weekday': 'int8', 'hour': 'int8', 'week_of_year': 'int8', 'day_of_year': 'int16'}
+
+# Crime counts are materialized in a few rollups, so the dashboard charts can be
+# served without scanning the individual crimes. Crossing every dimension would
+# leave almost every crime in a cell of its own, so each rollup only adds one
+# location or a calendar grain to the columns of the sidebar filters, and a
+# chart is counted from the smallest rollup holding its columns.
+CUBE_FILTER_DIMENSIONS = ['District', 'Primary Type', 'Arrest', 'Domestic']
+CUBE_ROLLUPS = {
+    'filters': CUBE_FILTER_DIMENSIONS,
+    'beat': CUBE_FILTER_DIMENSIONS + ['Beat', 'Year'],
+    'ward': CUBE_FILTER_DIMENSIONS + ['Ward', 'Year'],
+    'community_area': CUBE_FILTER_DIMENSIONS + ['Community Area', 'Year'],
+    'month': CUBE_FILTER_DIMENSIONS + ['Year', 'month'],
+    'weekday_hour': CUBE_FILTER_DIMENSIONS + ['weekday', 'hour'],
+}
 
+# Crimes with valid coordinates are also counted per geohash cell, a precision
+# of 6 gives cells of about 0.9 x 0.6 km (east-west by north-south) at Chicago's
+# latitude. Only the counts per cell are kept, and
+# every stored count is of at least HOTSPOT_MIN_COUNT crimes: the smaller ones
+# are rolled up, one group of columns after the other, into a count where the
+# rolled up columns are null (any value), and what is still too small once every
+# column is rolled up is dropped. Any sum or difference of filter selections is
+# then made of whole stored counts, so no view singles out a handful of crimes.
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 6
+HOTSPOT_MIN_COUNT = 10
+HOTSPOT_DIMENSIONS = ['Geohash', 'Primary Type', 'District', 'Arrest', 'Domestic', 'Year']
+HOTSPOT_ROLLUP_ORDER = [['Arrest', 'Domestic'], ['Primary Type'], ['District'], ['Year']]
+# Nullable types of the rolled up columns in the stored index
+HOTSPOT_DTYPES = {'District': 'Int8', 'Arrest': 'boolean', 'Domestic': 'boolean', 'Year': 'Int16'}
+# Coordinates outside the city are geocoding errors
+CHICAGO_BOUNDS = {'Latitude': (41.6, 42.1), 'Longitude': (-88.0, -87.5)}
 
-def get_data_preprocess():
-    chicago_crimes_df = pd.read_csv('Crimes_-_2001_to_Present.csv')
-    columns_to_drop = ['Case Number', 'IUCR', 'Description', 'FBI Code', 'X Coordinate', 
-                   'Y Coordinate', 'Updated On', 'Location', ]
+DEFAULT_MAX_MEMORY_MB = 1024
+# A chunk is copied a few times while its nulls are filled and it is written out
+CHUNK_MEMORY_OVERHEAD = 3
+# Share of the streaming mode's memory ceiling kept for the partial counts of
+# the cube and the hotspot index, the chunks are sized with the rest
+COUNTS_MEMORY_SHARE = 0.25
+# The counts of a crime take over ten times less memory than its raw CSV line,
+# a partition of the spilled counts is sized with a safe margin on that
+RAW_BYTES_PER_COUNTS_BYTE = 4
+# Raw CSV bytes handed to a worker at a time in parallel mode
+PARALLEL_PART_MB = 128
 
-    chicago_crimes_df.drop(columns=columns_to_drop, inplace=True) 
-    # Create a mapping of blocks to their respective community areas and wards
-    block_to_community_mapping = chicago_crimes_df.dropna(subset=['Community Area', 'Block']).set_index('Block')['Community Area'].to_dict()
-    block_to_ward_mapping = chicago_crimes_df.dropna(subset=['Ward', 'Block']).set_index('Block')['Ward'].to_dict()
 
+def drop_unused_columns(chicago_crimes_df):
+    chicago_crimes_df.drop(columns=COLUMNS_TO_DROP, inplace=True)
+
+
+def build_block_mappings(chicago_crimes_df, columns=BLOCK_IMPUTED_COLUMNS):
+    # Create a mapping of blocks to their respective community areas and wards,
+    # the last row reported for a block wins
+    block_mappings = {}
+    for column in columns:
+        known_df = chicago_crimes_df.dropna(subset=[column, 'Block'])
+        block_mappings[column] = known_df.drop_duplicates(subset='Block', keep='last').set_index('Block')[column]
+    return block_mappings
+
+
+def merge_block_mappings(block_mappings, newer_block_mappings):
+    for column, mapping in newer_block_mappings.items():
+        if column in block_mappings:
+            mapping = pd.concat([block_mappings[column], mapping])
+            mapping = mapping[~mapping.index.duplicated(keep='last')]
+        block_mappings[column] = mapping
+    return block_mappings
+
+
+def impute_from_block(chicago_crimes_df, block_mappings):
+    for column, mapping in block_mappings.items():
+        missing = chicago_crimes_df[column].isna()
+        if not missing.any():
+            continue
+        # Look every distinct block up once, then spread the result by category code.
+        # Unknown or missing blocks get code -1, which picks the trailing NaN.
+        block_codes, blocks = pd.factorize(chicago_crimes_df.loc[missing, 'Block'])
+        lookup = np.append(mapping.reindex(blocks).to_numpy(), np.nan)
+        chicago_crimes_df.loc[missing, column] = lookup[block_codes]
+
+
+def fill_missing_values(chicago_crimes_df, block_mappings):
     # Fill NaN values in 'Community Area' and 'Ward' columns using the mappings
-    chicago_crimes_df['Community Area'] = chicago_crimes_df.apply(lambda row: block_to_community_mapping.get(row['Block']) if pd.isna(row['Community Area']) else row['Community Area'], axis=1)
-    chicago_crimes_df['Ward'] = chicago_crimes_df.apply(lambda row: block_to_ward_mapping.get(row['Block']) if pd.isna(row['Ward']) else row['Ward'], axis=1)
+    impute_from_block(chicago_crimes_df, block_mappings)
 
     chicago_crimes_df['Location Description'].fillna("not specified", inplace=True)
-    chicago_crimes_df['Longitude'].fillna("not specified", inplace=True)
-    chicago_crimes_df['Latitude'].fillna("not specified", inplace=True)
     chicago_crimes_df['Community Area'].fillna(100, inplace=True)
     chicago_crimes_df['Ward'].fillna(100, inplace=True)
     chicago_crimes_df['District'].fillna(100, inplace=True)
 
-    chicago_crimes_df.to_csv("preprocessed_crimes.csv")
 
-get_data_preprocess()
\ No newline at end of file
+def changed_block_mappings(block_mappings, older_block_mappings):
+    # Blocks per column that were mapped for the first time or to another value
+    changed_blocks = {}
+    for column, mapping in block_mappings.items():
+        older_mapping = older_block_mappings.get(column, pd.Series(dtype='float64'))
+        changed_blocks[column] = mapping.index[mapping.ne(older_mapping.reindex(mapping.index)).to_numpy()]
+    return changed_blocks
+
+
+def sentinel_rows(chicago_crimes_df, changed_blocks):
+    # Stored rows filled with the sentinel 100 whose block a rebuild would now impute
+    is_sentinel = pd.Series(False, index=chicago_crimes_df.index)
+    for column, blocks in changed_blocks.items():
+        is_sentinel |= (chicago_crimes_df[column] == 100) & chicago_crimes_df['Block'].isin(blocks)
+    return is_sentinel
+
+
+def reimpute_sentinels(chicago_crimes_df, block_mappings, changed_blocks):
+    for column, blocks in changed_blocks.items():
+        is_sentinel = (chicago_crimes_df[column] == 100) & chicago_crimes_df['Block'].isin(blocks)
+        if is_sentinel.any():
+            values = block_mappings[column].reindex(chicago_crimes_df.loc[is_sentinel, 'Block'].astype(str)).to_numpy()
+            chicago_crimes_df.loc[is_sentinel, column] = values.astype(chicago_crimes_df[column].dtype)
+
+
+def calendar_feature(dates, name):
+    if name == 'week_of_year':
+        values = dates.dt.isocalendar().week
+    else:
+        values = getattr(dates.dt, name)
+    return values.astype(CALENDAR_FEATURES[name])
+
+
+def convert_column_types(chicago_crimes_df):
+    # Dates are parsed once here so the app never has to
+    for column in DATE_COLUMNS:
+        chicago_crimes_df[column] = pd.to_datetime(chicago_crimes_df[column], format=DATE_FORMAT)
+    for name in CALENDAR_FEATURES:
+        chicago_crimes_df[name] = calendar_feature(chicago_crimes_df['Date'], name)
+    for column in CATEGORY_COLUMNS:
+        chicago_crimes_df[column] = chicago_crimes_df[column].astype('category')
+    for column, dtype in COLUMN_DTYPES.items():
+        chicago_crimes_df[column] = chicago_crimes_df[column].astype(dtype)
+
+
+def parquet_schema(chicago_crimes_df):
+    # Every chunk has its own categories, so fix the dictionary index width up front
+    schema = pa.Schema.from_pandas(chicago_crimes_df, preserve_index=False)
+    for index, field in enumerate(schema):
+        if pa.types.is_dictionary(field.type):
+            schema = schema.set(index, field.with_type(pa.dictionary(pa.int32(), field.type.value_type)))
+    return schema
+
+
+def concat_crimes(chicago_crimes_dfs):
+    # Concatenating categoricals with different categories falls back to object
+    chicago_crimes_df = pd.concat(chicago_crimes_dfs, ignore_index=True)
+    for column in CATEGORY_COLUMNS:
+        chicago_crimes_df[column] = chicago_crimes_df[column].astype('category')
+    return chicago_crimes_df
+
+
+def partition_path(year):
+    return os.path.join(OUTPUT_PATH, f"{year}.parquet")
+
+
+def stored_years():
+    return sorted(int(file_name.split('.')[0]) for file_name in os.listdir(OUTPUT_PATH) if file_name.endswith('.parquet'))
+
+
+def reset_output():
+    shutil.rmtree(OUTPUT_PATH, ignore_errors=True)
+    os.makedirs(OUTPUT_PATH)
+
+
+def write_partition(chicago_crimes_df, year):
+    table = pa.Table.from_pandas(chicago_crimes_df, schema=parquet_schema(chicago_crimes_df), preserve_index=False)
+    pq.write_table(table, partition_path(year))
+
+
+def save_block_mappings(block_mappings):
+    mappings_df = pd.DataFrame(block_mappings).rename_axis('Block').reset_index()
+    mappings_df.to_parquet(MAPPINGS_PATH, index=False)
+
+
+def load_block_mappings():
+    mappings_df = pd.read_parquet(MAPPINGS_PATH).set_index('Block')
+    return {column: mappings_df[column].dropna() for column in mappings_df.columns}
+
+
+def save_state(watermark):
+    # The watermark is the latest 'Updated On' already in the store, the data
+    # version changes on every write so readers can tell their caches are stale
+    state = {'watermark': watermark.isoformat(), 'data_version': pd.Timestamp.now().isoformat()}
+    with open(STATE_PATH, 'w') as state_file:
+        json.dump(state, state_file)
+
+
+def load_state():
+    with open(STATE_PATH) as state_file:
+        return json.load(state_file)
+
+
+def build_counts(chicago_crimes_df, dimensions):
+    crime_counts_df = chicago_crimes_df.groupby(dimensions, observed=True).size().reset_index(name='Count')
+    crime_counts_df['Count'] = crime_counts_df['Count'].astype('int32')
+    return crime_counts_df
+
+
+def merge_counts(crime_counts_dfs, dimensions):
+    crime_counts_df = pd.concat(crime_counts_dfs, ignore_index=True)
+    crime_counts_df = crime_counts_df.groupby(dimensions, observed=True)['Count'].sum().reset_index()
+    crime_counts_df = crime_counts_df[crime_counts_df['Count'] != 0].reset_index(drop=True)
+    # Categoricals with different categories are concatenated as strings
+    for column in crime_counts_df.select_dtypes('object').columns:
+        crime_counts_df[column] = crime_counts_df[column].astype('category')
+    crime_counts_df['Count'] = crime_counts_df['Count'].astype('int32')
+    return crime_counts_df
+
+
+def concat_counts(crime_counts_dfs):
+    # Counts of disjoint keys, put together without grouping them again
+    crime_counts_df = pd.concat(crime_counts_dfs, ignore_index=True)
+    for column in crime_counts_df.select_dtypes('object').columns:
+        crime_counts_df[column] = crime_counts_df[column].astype('category')
+    return crime_counts_df
+
+
+def negated_counts(crime_counts_df):
+    return crime_counts_df.assign(Count=-crime_counts_df['Count'])
+
+
+def build_crime_counts_cube(chicago_crimes_df):
+    return {name: build_counts(chicago_crimes_df, dimensions) for name, dimensions in CUBE_ROLLUPS.items()}
+
+
+def merge_crime_counts_cubes(crime_counts_cubes):
+    return {name: merge_counts([cube[name] for cube in crime_counts_cubes], dimensions)
+            for name, dimensions in CUBE_ROLLUPS.items()}
+
+
+class CountsAccumulator:
+    # Sums the counts of the chunks within max_bytes. The partial counts are
+    # merged in memory while that shrinks them enough, otherwise they are
+    # spilled to disk, split in n_partitions by a hash of partition_columns.
+    # Every partition is then merged on its own, so neither the merges nor the
+    # final counts ever need the whole of them in memory.
+    def __init__(self, dimensions, max_bytes, n_partitions, spill_dir, partition_columns=None):
+        self.dimensions = dimensions
+        self.max_bytes = max_bytes
+        self.n_partitions = n_partitions
+        self.spill_dir = spill_dir
+        self.partition_columns = partition_columns or dimensions
+        self.pending = []
+        self.pending_bytes = 0
+        self.spill_writers = {}
+
+    def add(self, counts_df):
+        self.pending.append(counts_df)
+        self.pending_bytes += counts_df.memory_usage(deep=True).sum()
+        if self.pending_bytes > self.max_bytes / 2:
+            merged_df = merge_counts(self.pending, self.dimensions)
+            merged_bytes = merged_df.memory_usage(deep=True).sum()
+            if merged_bytes > self.max_bytes / 4:
+                self.spill(merged_df)
+                self.pending, self.pending_bytes = [], 0
+            else:
+                self.pending, self.pending_bytes = [merged_df], merged_bytes
+
+    def spill(self, counts_df):
+        if not self.spill_writers:
+            os.makedirs(self.spill_dir)
+            self.schema = parquet_schema(counts_df)
+        partitions = pd.util.hash_pandas_object(counts_df[self.partition_columns], index=False).to_numpy() % self.n_partitions
+        for partition, partition_df in counts_df.groupby(partitions):
+            if partition not in self.spill_writers:
+                self.spill_writers[partition] = pq.ParquetWriter(os.path.join(self.spill_dir, f"{partition}.parquet"), self.schema)
+            self.spill_writers[partition].write_table(pa.Table.from_pandas(partition_df, schema=self.schema, preserve_index=False))
+
+    def merged_partitions(self):
+        # The final counts, one partition at a time
+        if not self.spill_writers:
+            yield merge_counts(self.pending, self.dimensions)
+            return
+        if self.pending:
+            self.spill(merge_counts(self.pending, self.dimensions))
+            self.pending, self.pending_bytes = [], 0
+        for partition, spill_writer in self.spill_writers.items():
+            spill_writer.close()
+            yield merge_counts([pd.read_parquet(os.path.join(self.spill_dir, f"{partition}.parquet"))], self.dimensions)
+
+
+class CountsWriter:
+    # Appends counts to one Parquet file, with the schema of the first counts written
+    def __init__(self, path):
+        self.path = path
+        self.parquet_writer = None
+
+    def write(self, counts_df):
+        if self.parquet_writer is None:
+            self.schema = parquet_schema(counts_df)
+            self.parquet_writer = pq.ParquetWriter(self.path, self.schema)
+        self.parquet_writer.write_table(pa.Table.from_pandas(counts_df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def write_counts(counts_dfs, path):
+    counts_writer = CountsWriter(path)
+    for counts_df in counts_dfs:
+        counts_writer.write(counts_df)
+    counts_writer.close()
+
+
+def rollup_path(name):
+    return os.path.join(CUBE_PATH, f"{name}.parquet")
+
+
+def reset_crime_counts_cube():
+    shutil.rmtree(CUBE_PATH, ignore_errors=True)
+    os.makedirs(CUBE_PATH)
+
+
+def save_crime_counts_cube(crime_counts_cube):
+    reset_crime_counts_cube()
+    for name, crime_counts_df in crime_counts_cube.items():
+        crime_counts_df.to_parquet(rollup_path(name), index=False)
+
+
+def load_crime_counts_cube():
+    return {name: pd.read_parquet(rollup_path(name)) for name in CUBE_ROLLUPS}
+
+
+def geohash_cells(latitudes, longitudes, precision=GEOHASH_PRECISION):
+    # Vectorized geohash: the cell's bits alternate between halving the
+    # longitude and the latitude range, starting with the longitude
+    bits = 5 * precision
+    longitude_bits, latitude_bits = (bits + 1) // 2, bits // 2
+    latitude_index = np.clip(((latitudes + 90) / 180 * 2**latitude_bits).astype('int64'), 0, 2**latitude_bits - 1)
+    longitude_index = np.clip(((longitudes + 180) / 360 * 2**longitude_bits).astype('int64'), 0, 2**longitude_bits - 1)
+    cells = np.zeros(len(latitude_index), dtype='int64')
+    for bit in range(bits):
+        index, index_bits = (longitude_index, longitude_bits) if bit % 2 == 0 else (latitude_index, latitude_bits)
+        cells = (cells << 1) | ((index >> (index_bits - 1 - bit // 2)) & 1)
+    return cells
+
+
+def geohash_strings(cells, precision=GEOHASH_PRECISION):
+    return [''.join(GEOHASH_ALPHABET[(cell >> 5 * (precision - 1 - char)) & 31] for char in range(precision)) for cell in cells]
+
+
+def geohash_centers(geohashes):
+    # Latitude and longitude at the center of every cell
+    latitudes, longitudes = [], []
+    for geohash in geohashes:
+        latitude_range, longitude_range = [-90.0, 90.0], [-180.0, 180.0]
+        bit = 0
+        for char in geohash:
+            value = GEOHASH_ALPHABET.index(char)
+            for shift in range(4, -1, -1):
+                bounds = longitude_range if bit % 2 == 0 else latitude_range
+                middle = (bounds[0] + bounds[1]) / 2
+                bounds[(value >> shift) & 1 ^ 1] = middle
+                bit += 1
+        latitudes.append(sum(latitude_range) / 2)
+        longitudes.append(sum(longitude_range) / 2)
+    return latitudes, longitudes
+
+
+def build_hotspot_index(chicago_crimes_df):
+    latitudes = chicago_crimes_df['Latitude'].to_numpy(dtype='float64', na_value=np.nan)
+    longitudes = chicago_crimes_df['Longitude'].to_numpy(dtype='float64', na_value=np.nan)
+    (min_latitude, max_latitude), (min_longitude, max_longitude) = CHICAGO_BOUNDS['Latitude'], CHICAGO_BOUNDS['Longitude']
+    is_located = ((latitudes >= min_latitude) & (latitudes <= max_latitude)
+                  & (longitudes >= min_longitude) & (longitudes <= max_longitude))
+
+    # Cells are encoded as integers and only the distinct ones spelled out
+    cells, cell_codes = np.unique(geohash_cells(latitudes[is_located], longitudes[is_located]), return_inverse=True)
+    located_df = chicago_crimes_df.loc[is_located, HOTSPOT_DIMENSIONS[1:]]
+    located_df.insert(0, 'Geohash', pd.Categorical.from_codes(cell_codes.reshape(-1), geohash_strings(cells.tolist())))
+    return build_counts(located_df, HOTSPOT_DIMENSIONS)
+
+
+def merge_hotspot_indexes(hotspots_dfs):
+    return merge_counts(hotspots_dfs, HOTSPOT_DIMENSIONS)
+
+
+def suppress_hotspots(hotspots_df, min_count=HOTSPOT_MIN_COUNT):
+    # Rolls the counts below min_count up, see HOTSPOT_ROLLUP_ORDER. Cells never
+    # mix geohashes, so the index may be suppressed one geohash partition at a time.
+    hotspots_df = hotspots_df.astype(HOTSPOT_DTYPES)
+    for columns in HOTSPOT_ROLLUP_ORDER:
+        is_small = hotspots_df['Count'] < min_count
+        if not is_small.any():
+            break
+        small_df = hotspots_df[is_small].copy()
+        for column in columns:
+            small_df[column] = pd.Series(None, index=small_df.index, dtype=small_df[column].dtype)
+        small_df = small_df.groupby(HOTSPOT_DIMENSIONS, observed=True, dropna=False)['Count'].sum().reset_index()
+        hotspots_df = pd.concat([hotspots_df[~is_small], small_df], ignore_index=True)
+    hotspots_df = hotspots_df[hotspots_df['Count'] >= min_count].reset_index(drop=True)
+    for column in hotspots_df.select_dtypes('object').columns:
+        hotspots_df[column] = hotspots_df[column].astype('category')
+    hotspots_df['Count'] = hotspots_df['Count'].astype('int32')
+    return hotspots_df
+
+
+def save_hotspot_indexes(hotspot_counts_df):
+    hotspot_counts_df.to_parquet(HOTSPOT_COUNTS_PATH, index=False)
+    suppress_hotspots(hotspot_counts_df).to_parquet(HOTSPOTS_PATH, index=False)
+
+
+def update_hotspot_indexes(hotspot_deltas):
+    # The suppressed index is not additive, so the deltas go to the additive
+    # counts like for the cube, and only the geohashes they touch are
+    # suppressed again
+    delta_df = merge_hotspot_indexes(hotspot_deltas)
+    hotspot_counts_df = pd.read_parquet(HOTSPOT_COUNTS_PATH)
+    is_touched = hotspot_counts_df['Geohash'].isin(delta_df['Geohash'])
+    touched_counts_df = merge_hotspot_indexes([hotspot_counts_df[is_touched], delta_df])
+    hotspots_df = pd.read_parquet(HOTSPOTS_PATH)
+    untouched_hotspots_df = hotspots_df[~hotspots_df['Geohash'].isin(delta_df['Geohash'])]
+    concat_counts([hotspot_counts_df[~is_touched], touched_counts_df]).to_parquet(HOTSPOT_COUNTS_PATH, index=False)
+    concat_counts([untouched_hotspots_df, suppress_hotspots(touched_counts_df)]).to_parquet(HOTSPOTS_PATH, index=False)
+
+
+def get_data_preprocess(raw_data_path=RAW_DATA_PATH):
+    chicago_crimes_df = pd.read_csv(raw_data_path, dtype=RAW_DTYPES)
+    drop_unused_columns(chicago_crimes_df)
+    block_mappings = build_block_mappings(chicago_crimes_df)
+    fill_missing_values(chicago_crimes_df, block_mappings)
+    convert_column_types(chicago_crimes_df)
+
+    reset_output()
+    for year, year_df in chicago_crimes_df.groupby(chicago_crimes_df['Date'].dt.year):
+        write_partition(year_df, year)
+    save_crime_counts_cube(build_crime_counts_cube(chicago_crimes_df))
+    save_hotspot_indexes(build_hotspot_index(chicago_crimes_df))
+    save_block_mappings(block_mappings)
+    save_state(chicago_crimes_df['Updated On'].max())
+
+
+def estimate_chunk_rows(raw_data_path, max_memory_mb, sample_rows=10000):
+    sample_df = pd.read_csv(raw_data_path, nrows=sample_rows, dtype=RAW_DTYPES)
+    bytes_per_row = sample_df.memory_usage(index=True, deep=True).sum() / max(len(sample_df), 1)
+    return max(int(max_memory_mb * 1024 * 1024 / (bytes_per_row * CHUNK_MEMORY_OVERHEAD)), 1)
+
+
+def build_block_mappings_streaming(raw_data_path, chunk_rows):
+    # First pass: only the lookup columns are read, later chunks overwrite earlier
+    # blocks exactly like the last occurrence wins in build_block_mappings
+    block_mappings = {}
+    for chunk in pd.read_csv(raw_data_path, usecols=MAPPING_COLUMNS, dtype=RAW_DTYPES, chunksize=chunk_rows):
+        merge_block_mappings(block_mappings, build_block_mappings(chunk))
+    return block_mappings
+
+
+def get_data_preprocess_streaming(raw_data_path=RAW_DATA_PATH, max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+    chunk_rows = estimate_chunk_rows(raw_data_path, max_memory_mb * (1 - COUNTS_MEMORY_SHARE))
+    block_mappings = build_block_mappings_streaming(raw_data_path, chunk_rows)
+    with tempfile.TemporaryDirectory() as spill_dir:
+        preprocess_chunks(raw_data_path, max_memory_mb, chunk_rows, block_mappings, spill_dir)
+
+
+def preprocess_chunks(raw_data_path, max_memory_mb, chunk_rows, block_mappings, spill_dir):
+    # Every rollup and the hotspot index get an equal share of the counts' memory
+    counts_max_bytes = max_memory_mb * 2**20 * COUNTS_MEMORY_SHARE / (len(CUBE_ROLLUPS) + 1)
+    n_partitions = max(math.ceil(os.path.getsize(raw_data_path) / (counts_max_bytes * RAW_BYTES_PER_COUNTS_BYTE)), 1)
+    cube_accumulators = {name: CountsAccumulator(dimensions, counts_max_bytes, n_partitions, os.path.join(spill_dir, name))
+                         for name, dimensions in CUBE_ROLLUPS.items()}
+    hotspots_accumulator = CountsAccumulator(HOTSPOT_DIMENSIONS, counts_max_bytes, n_partitions,
+                                             os.path.join(spill_dir, 'hotspots'), partition_columns=['Geohash'])
+
+    # Second pass: every chunk is cleaned and appended to its years' files as row groups
+    reset_output()
+    parquet_writers = {}
+    watermark = None
+    for chunk in pd.read_csv(raw_data_path, dtype=RAW_DTYPES, chunksize=chunk_rows):
+        drop_unused_columns(chunk)
+        fill_missing_values(chunk, block_mappings)
+        convert_column_types(chunk)
+        if not parquet_writers:
+            schema = parquet_schema(chunk)
+        for year, year_df in chunk.groupby(chunk['Date'].dt.year):
+            if year not in parquet_writers:
+                parquet_writers[year] = pq.ParquetWriter(partition_path(year), schema)
+            parquet_writers[year].write_table(pa.Table.from_pandas(year_df, schema=schema, preserve_index=False))
+
+        for name, chunk_counts_df in build_crime_counts_cube(chunk).items():
+            cube_accumulators[name].add(chunk_counts_df)
+        hotspots_accumulator.add(build_hotspot_index(chunk))
+        watermark = chunk['Updated On'].max() if watermark is None else max(watermark, chunk['Updated On'].max())
+    for parquet_writer in parquet_writers.values():
+        parquet_writer.close()
+    if watermark is not None:
+        reset_crime_counts_cube()
+        for name, cube_accumulator in cube_accumulators.items():
+            write_counts(cube_accumulator.merged_partitions(), rollup_path(name))
+        # Partitions never share a geohash, so each one is suppressed on its own
+        hotspot_counts_writer, hotspots_writer = CountsWriter(HOTSPOT_COUNTS_PATH), CountsWriter(HOTSPOTS_PATH)
+        for hotspot_counts_df in hotspots_accumulator.merged_partitions():
+            hotspot_counts_writer.write(hotspot_counts_df)
+            hotspots_writer.write(suppress_hotspots(hotspot_counts_df))
+        hotspot_counts_writer.close()
+        hotspots_writer.close()
+        save_block_mappings(block_mappings)
+        save_state(watermark)
+
+
+def split_raw_data(raw_data_path, n_parts):
+    # Byte ranges of about equal size starting and ending on line boundaries,
+    # no field of the export spans lines
+    file_size = os.path.getsize(raw_data_path)
+    with open(raw_data_path, 'rb') as raw_file:
+        header = raw_file.readline()
+        offsets = [raw_file.tell()]
+        for part in range(1, n_parts):
+            raw_file.seek(max(offsets[0] + (file_size - offsets[0]) * part // n_parts, offsets[-1]))
+            raw_file.readline()
+            offsets.append(raw_file.tell())
+    offsets.append(file_size)
+    return header, [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+def read_raw_range(raw_data_path, header, start, end, usecols=None):
+    with open(raw_data_path, 'rb') as raw_file:
+        raw_file.seek(start)
+        raw_bytes = raw_file.read(end - start)
+    return pd.read_csv(io.BytesIO(header + raw_bytes), usecols=usecols, dtype=RAW_DTYPES)
+
+
+def part_path(year, part_number):
+    # Leading underscore: readers of the store skip the parts until they are merged
+    return os.path.join(OUTPUT_PATH, f"_{year}-{part_number:05d}.parquet")
+
+
+def build_block_mappings_part(raw_data_path, header, start, end):
+    return build_block_mappings(read_raw_range(raw_data_path, header, start, end, usecols=MAPPING_COLUMNS))
+
+
+def preprocess_part(raw_data_path, header, start, end, block_mappings, part_number):
+    chicago_crimes_df = read_raw_range(raw_data_path, header, start, end)
+    drop_unused_columns(chicago_crimes_df)
+    fill_missing_values(chicago_crimes_df, block_mappings)
+    convert_column_types(chicago_crimes_df)
+
+    years = []
+    for year, year_df in chicago_crimes_df.groupby(chicago_crimes_df['Date'].dt.year):
+        pq.write_table(pa.Table.from_pandas(year_df, schema=parquet_schema(year_df), preserve_index=False),
+                       part_path(year, part_number))
+        years.append(year)
+    return (years, build_crime_counts_cube(chicago_crimes_df), build_hotspot_index(chicago_crimes_df),
+            chicago_crimes_df['Updated On'].max())
+
+
+def merge_partition_parts(year, part_numbers):
+    # Parts are concatenated in file order, so every year keeps the row order of
+    # the sequential preprocessing
+    part_paths = [part_path(year, part_number) for part_number in part_numbers]
+    tables = [pq.read_table(path) for path in part_paths]
+    metadata = tables[0].schema.metadata
+    pq.write_table(pa.concat_tables([table.replace_schema_metadata(metadata) for table in tables]), partition_path(year))
+    for path in part_paths:
+        os.remove(path)
+
+
+def get_data_preprocess_parallel(raw_data_path=RAW_DATA_PATH, workers=None):
+    # The raw export is split into row ranges processed in a pool of processes.
+    # The block mappings are built over all ranges first and merged in file order,
+    # so every range is imputed with the same global mappings.
+    workers = workers or os.cpu_count()
+    n_parts = max(workers, math.ceil(os.path.getsize(raw_data_path) / (PARALLEL_PART_MB * 2**20)))
+    header, byte_ranges = split_raw_data(raw_data_path, n_parts)
+    starts, ends = zip(*byte_ranges)
+    part_count = len(byte_ranges)
+
+    reset_output()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        block_mappings = {}
+        for part_mappings in executor.map(build_block_mappings_part, [raw_data_path] * part_count, [header] * part_count, starts, ends):
+            merge_block_mappings(block_mappings, part_mappings)
+
+        part_futures = [executor.submit(preprocess_part, raw_data_path, header, start, end, block_mappings, part_number)
+                        for part_number, (start, end) in enumerate(byte_ranges)]
+        year_parts = {}
+        crime_counts_cubes = []
+        hotspots_dfs = []
+        watermark = None
+        for part_number, part_future in enumerate(part_futures):
+            years, part_counts_cube, part_hotspots_df, part_watermark = part_future.result()
+            for year in years:
+                year_parts.setdefault(year, []).append(part_number)
+            crime_counts_cubes.append(part_counts_cube)
+            hotspots_dfs.append(part_hotspots_df)
+            watermark = part_watermark if watermark is None else max(watermark, part_watermark)
+
+        list(executor.map(merge_partition_parts, year_parts.keys(), year_parts.values()))
+
+    save_crime_counts_cube(merge_crime_counts_cubes(crime_counts_cubes))
+    save_hotspot_indexes(merge_hotspot_indexes(hotspots_dfs))
+    save_block_mappings(block_mappings)
+    save_state(watermark)
+
+
+def read_changed_crimes(raw_data_path, watermark, chunk_rows):
+    # 'Updated On' is the timestamp of a whole batch of the portal, so records
+    # stamped with the watermark itself may not have been in the last export.
+    # They are read again, upserting a record by ID twice changes nothing.
+    changed_chunks = []
+    for chunk in pd.read_csv(raw_data_path, dtype=RAW_DTYPES, chunksize=chunk_rows):
+        updated_on = pd.to_datetime(chunk['Updated On'], format=DATE_FORMAT)
+        changed_chunks.append(chunk[updated_on >= watermark])
+    return pd.concat(changed_chunks, ignore_index=True)
+
+
+def get_data_update(raw_data_path=RAW_DATA_PATH, max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+    # Upserts the records added or changed since the last run into the store.
+    # raw_data_path may be the full export or only the latest records, just the
+    # rows updated after the watermark are processed.
+    state = load_state()
+    chunk_rows = estimate_chunk_rows(raw_data_path, max_memory_mb)
+    changed_df = read_changed_crimes(raw_data_path, pd.Timestamp(state['watermark']), chunk_rows)
+    if changed_df.empty:
+        return
+
+    drop_unused_columns(changed_df)
+    older_block_mappings = load_block_mappings()
+    block_mappings = merge_block_mappings(dict(older_block_mappings), build_block_mappings(changed_df))
+    changed_blocks = changed_block_mappings(block_mappings, older_block_mappings)
+    fill_missing_values(changed_df, block_mappings)
+    convert_column_types(changed_df)
+    changed_df = changed_df.sort_values('Updated On', kind='stable').drop_duplicates(subset='ID', keep='last')
+
+    # A changed record replaces its stored version, which may sit in another year
+    # when its date was corrected, so the ID column of every year is checked.
+    # Stored rows left with the sentinel 100 because their block was not mapped
+    # yet are imputed again once the update maps it, as a rebuild would.
+    changed_years = changed_df['Date'].dt.year
+    replaced_dfs = []
+    reimputed_dfs = []
+    for year in sorted(set(stored_years()) | set(changed_years)):
+        year_changed_df = changed_df[changed_years == year]
+        if os.path.exists(partition_path(year)):
+            stored_keys_df = pd.read_parquet(partition_path(year), columns=MAPPING_COLUMNS + ['ID'])
+            is_replaced = stored_keys_df['ID'].isin(changed_df['ID'])
+            is_reimputed = ~is_replaced & sentinel_rows(stored_keys_df, changed_blocks)
+            if year_changed_df.empty and not (is_replaced | is_reimputed).any():
+                continue
+            stored_df = pd.read_parquet(partition_path(year))
+            replaced_dfs.append(stored_df[is_replaced | is_reimputed])
+            reimputed_df = stored_df[is_reimputed].copy()
+            reimpute_sentinels(reimputed_df, block_mappings, changed_blocks)
+            reimputed_dfs.append(reimputed_df)
+            year_df = concat_crimes([stored_df[~(is_replaced | is_reimputed)], reimputed_df, year_changed_df])
+        else:
+            year_df = year_changed_df
+        write_partition(year_df, year)
+
+    # Counts are additive, so the cube and the hotspot counts are updated by
+    # taking the replaced versions out and putting the new versions in
+    added_df = concat_crimes([changed_df] + reimputed_dfs)
+    crime_counts_cubes = [load_crime_counts_cube(), build_crime_counts_cube(added_df)]
+    hotspot_deltas = [build_hotspot_index(added_df)]
+    if replaced_dfs:
+        replaced_df = concat_crimes(replaced_dfs)
+        crime_counts_cubes.append({name: negated_counts(crime_counts_df)
+                                   for name, crime_counts_df in build_crime_counts_cube(replaced_df).items()})
+        hotspot_deltas.append(negated_counts(build_hotspot_index(replaced_df)))
+    save_crime_counts_cube(merge_crime_counts_cubes(crime_counts_cubes))
+    update_hotspot_indexes(hotspot_deltas)
+    save_block_mappings(block_mappings)
+    save_state(changed_df['Updated On'].max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess the Chicago crimes dataset.")
+    parser.add_argument('--streaming', action='store_true',
+                        help="read the raw CSV in bounded chunks instead of loading it at once")
+    parser.add_argument('--workers', type=int,
+                        help="preprocess row ranges of the raw CSV in this many processes (0 uses every core)")
+    parser.add_argument('--update', action='store_true',
+                        help="only upsert the records updated since the last run into the existing store")
+    parser.add_argument('--raw-data', default=RAW_DATA_PATH,
+                        help="raw CSV export to read, for --update it may hold only the latest records")
+    parser.add_argument('--max-memory-mb', type=int, default=DEFAULT_MAX_MEMORY_MB,
+                        help="memory ceiling used to size the chunks in streaming and update mode")
+    args = parser.parse_args()
+
+    if args.update:
+        get_data_update(args.raw_data, args.max_memory_mb)
+    elif args.workers is not None:
+        get_data_preprocess_parallel(args.raw_data, args.workers)
+    elif args.streaming:
+        get_data_preprocess_streaming(args.raw_data, args.max_memory_mb)
+    else:
+        get_data_preprocess(args.raw_data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+# Set CRIMES_INSTRUMENTATION=1 to measure the data loaders and chart helpers.
+# Off, the decorated functions are left untouched and cost nothing.
+ENABLED = os.environ.get('CRIMES_INSTRUMENTATION', '0') == '1'
+
+# Optional exports of the measurements: CRIMES_METRICS_LOG=1 logs one JSON
+# record per measurement on the 'crimes.metrics' logger, CRIMES_METRICS_FILE
+# is rewritten with the totals of the process in the Prometheus text format
+# (for the node exporter's textfile collector, for instance)
+LOG_METRICS = os.environ.get('CRIMES_METRICS_LOG', '0') == '1'
+METRICS_FILE = os.environ.get('CRIMES_METRICS_FILE')
+
+logger = logging.getLogger('crimes.metrics')
+
+# Measurements in progress and finished in the current script run. Streamlit
+# runs every session in its own thread, so they are kept per thread.
+local = threading.local()
+
+# Totals of the process per measured function, for the Prometheus export
+totals = {}
+totals_lock = threading.Lock()
+
+
+def active_measurements():
+    if not hasattr(local, 'stack'):
+        local.stack = []
+        local.records = []
+    return local.stack
+
+
+def start_run():
+    # Called at the top of every script run, the panel shows this run only
+    active_measurements()
+    local.records = []
+
+
+def run_records():
+    active_measurements()
+    return list(local.records)
+
+
+def record(**counters):
+    # Adds counters (rows_scanned, result_bytes, query_seconds, cache_hits,
+    # cache_misses, figure_seconds, render_seconds, payload_bytes) to every
+    # measurement in progress, the outer ones included
+    for measurement in active_measurements():
+        for name, value in counters.items():
+            measurement[name] += value
+
+
+def traced_peak():
+    return tracemalloc.get_traced_memory()[1]
+
+
+def instrumented(name=None, cached=False):
+    # Measures wall time, peak memory, rows scanned, result size and cache
+    # hits of every call. The peak is the memory traced above what was held
+    # when the call started, shared by the whole process, so it is only
+    # approximate while other sessions run. With cached, a call whose cached
+    # function body did not run (and record a miss) is counted as a hit.
+    def decorate(function):
+        if not ENABLED:
+            return function
+        measured_name = name or function.__name__
+
+        @functools.wraps(function)
+        def measured(*args, **kwargs):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            stack = active_measurements()
+            if stack:
+                # The parent's peak so far is kept before the peak is reset for this call
+                stack[-1]['peak_bytes'] = max(stack[-1]['peak_bytes'], traced_peak() - stack[-1]['start_bytes'])
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            measurement = {'name': measured_name, 'start_bytes': start_bytes, 'peak_bytes': 0, 'rows_scanned': 0,
+                           'result_bytes': 0, 'query_seconds': 0.0, 'cache_hits': 0, 'cache_misses': 0,
+                           'figure_seconds': 0.0, 'render_seconds': 0.0, 'payload_bytes': 0}
+            stack.append(measurement)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                measurement['seconds'] = time.perf_counter() - start
+                stack.pop()
+                measurement['peak_bytes'] = max(measurement['peak_bytes'], traced_peak() - start_bytes)
+                if stack:
+                    stack[-1]['peak_bytes'] = max(stack[-1]['peak_bytes'], traced_peak() - stack[-1]['start_bytes'])
+                if cached and not measurement['cache_misses']:
+                    measurement['cache_hits'] += 1
+                    for parent in stack:
+                        parent['cache_hits'] += 1
+                del measurement['start_bytes']
+                finish(measurement)
+
+        return measured
+    return decorate
+
+
+# Counters summed over the calls of a measured function
+COUNTERS = ['seconds', 'rows_scanned', 'result_bytes', 'query_seconds', 'cache_hits', 'cache_misses',
+            'figure_seconds', 'render_seconds', 'payload_bytes']
+
+
+def finish(measurement):
+    local.records.append(measurement)
+    with totals_lock:
+        total = totals.setdefault(measurement['name'], dict.fromkeys(['calls'] + COUNTERS + ['peak_bytes'], 0))
+        total['calls'] += 1
+        for counter in COUNTERS:
+            total[counter] += measurement[counter]
+        total['peak_bytes'] = max(total['peak_bytes'], measurement['peak_bytes'])
+    if LOG_METRICS:
+        logger.info(json.dumps(measurement))
+
+
+def prometheus_metrics():
+    # Counters per measured function, and the largest peak memory seen as a gauge
+    metrics = [
+        ('crimes_calls_total', 'counter', 'Calls of the measured function', 'calls'),
+        ('crimes_seconds_total', 'counter', 'Wall time spent in the measured function', 'seconds'),
+        ('crimes_query_seconds_total', 'counter', 'Time spent counting crimes in the data backends', 'query_seconds'),
+        ('crimes_rows_scanned_total', 'counter', 'Rows scanned by the data backends', 'rows_scanned'),
+        ('crimes_result_bytes_total', 'counter', 'Size of the counts pulled by the function', 'result_bytes'),
+        ('crimes_cache_hits_total', 'counter', 'Cache hits of the function', 'cache_hits'),
+        ('crimes_cache_misses_total', 'counter', 'Cache misses of the function', 'cache_misses'),
+        ('crimes_figure_seconds_total', 'counter', 'Time spent building Plotly figures', 'figure_seconds'),
+        ('crimes_render_seconds_total', 'counter', 'Time spent serializing charts and sending them to the browser', 'render_seconds'),
+        ('crimes_payload_bytes_total', 'counter', 'Size of the charts sent to the browser', 'payload_bytes'),
+        ('crimes_peak_memory_bytes', 'gauge', 'Largest peak of memory traced during a call', 'peak_bytes'),
+    ]
+    with totals_lock:
+        function_totals = {name: dict(total) for name, total in sorted(totals.items())}
+    lines = []
+    for metric, metric_type, description, counter in metrics:
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, total in function_totals.items():
+            lines.append(f'{metric}{{function="{name}"}} {total[counter]}')
+    return '\n'.join(lines) + '\n'
+
+
+def export_metrics():
+    # Written to a temporary file first so a scrape never reads half a file
+    if METRICS_FILE:
+        temporary_path = f"{METRICS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'w') as metrics_file:
+            metrics_file.write(prometheus_metrics())
+        os.replace(temporary_path, METRICS_FILE)
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from benchmark import (CHART_COUNTS, impute_from_block_rowwise, make_synthetic_crimes, normalized_counts, open_backends,
+                       prepare_update, preprocessed_outputs, synthetic_store)
+from crimes_preprocessed import (BLOCK_IMPUTED_COLUMNS, OUTPUT_PATH, build_block_mappings, get_data_preprocess,
+                                  get_data_update, impute_from_block)
+
+# Small enough to run in seconds, with blocks reported a handful of times each
+N_ROWS = 20000
+N_BLOCKS = 4000
+
+
+@pytest.fixture(scope='module')
+def store():
+    # Built once and shared by the read-only tests of the module
+    with synthetic_store(N_ROWS, n_blocks=N_BLOCKS):
+        yield
+
+
+def sentinel_ids():
+    stored_df = pd.read_parquet(OUTPUT_PATH, columns=['ID'] + BLOCK_IMPUTED_COLUMNS)
+    return set(stored_df.loc[(stored_df[BLOCK_IMPUTED_COLUMNS] == 100).any(axis=1), 'ID'])
+
+
+@pytest.mark.parametrize('source, keys, filters', [(source, keys, filters) for source, chart_counts in CHART_COUNTS.items()
+                                                   for keys, filters in chart_counts])
+def test_backends_match_pandas(store, source, keys, filters):
+    results = {name: normalized_counts(sources[source].count(keys, filters), keys) for name, sources in open_backends().items()}
+    pd.testing.assert_frame_equal(results['duckdb'], results['pandas'], check_dtype=False)
+
+
+def test_vectorized_imputation_matches_rowwise():
+    chicago_crimes_df = make_synthetic_crimes(N_ROWS, n_blocks=N_BLOCKS)
+    block_mappings = build_block_mappings(chicago_crimes_df)
+    rowwise_df = chicago_crimes_df.copy()
+    vectorized_df = chicago_crimes_df.copy()
+    impute_from_block_rowwise(rowwise_df, block_mappings)
+    impute_from_block(vectorized_df, block_mappings)
+    pd.testing.assert_frame_equal(vectorized_df, rowwise_df)
+
+
+def test_update_matches_rebuild():
+    # With many more blocks than rows, the update maps blocks some stored
+    # crimes were filled with the sentinel for
+    n_corrected = 200
+    with synthetic_store(N_ROWS, preprocess=False) as raw_crimes_df:
+        prepare_update(raw_crimes_df, n_corrected=n_corrected)
+        stored_sentinel_ids = sentinel_ids()
+        get_data_update()
+        # The corrected records are replaced anyway, the others must be imputed again
+        assert {crime_id for crime_id in stored_sentinel_ids - sentinel_ids() if crime_id > n_corrected}
+        updated_outputs = preprocessed_outputs()
+
+        get_data_preprocess()
+        for name, rebuilt_df in preprocessed_outputs().items():
+            pd.testing.assert_frame_equal(updated_outputs[name], rebuilt_df, check_dtype=False, check_categorical=False,
+                                          obj=name)